@@ -0,0 +1,858 @@
+# bench.py
+# KOOPA ENGINE micro-benchmarks
+# Runs headless: python bench.py [name ...]
+
+import argparse
+import gc
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+# Level files go to a throwaway directory, not the user's cache
+LEVEL_CACHE_DIR = tempfile.TemporaryDirectory(prefix="koopa-bench-")
+os.environ.setdefault("KOOPA_LEVEL_CACHE", LEVEL_CACHE_DIR.name)
+
+import pygame
+import mario4k
+
+mario4k.init(headless=True)
+
+
+def timeit(fn, repeat=2000):
+    """Best-of-3 average time per call in microseconds"""
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        elapsed = (time.perf_counter() - start) / repeat * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def report(name, before, after, unit="us"):
+    print(f"{name:<28} before {before:9.2f}{unit}  after {after:9.2f}{unit}  "
+          f"x{before / after:6.1f}")
+
+
+# ---------------------------------------------
+# Tile blit (PatternTable vs TileAtlas)
+# ---------------------------------------------
+def bench_tiles(args):
+    surface = mario4k.DISPLAY
+    pal = mario4k.WORLD_PALETTES[0]['fg']
+
+    def uncached():
+        tile_data = mario4k.PatternTable.make_tile("brick")
+        tile_surf = mario4k.PatternTable.render_tile(tile_data, pal)
+        surface.blit(tile_surf, (64, 64))
+
+    def cached():
+        mario4k.TILE_ATLAS.blit(surface, "brick", pal, (64, 64))
+
+    report("tile blit", timeit(uncached), timeit(cached))
+
+    level = mario4k.NESLevel(0, 0)
+    atlas = mario4k.TILE_ATLAS
+    bricks = [(x * 8, y * 8) for y in range(level.height) for x in range(32)
+              if level.get_tile(x * 8, y * 8) == 1]
+
+    def screen_uncached():
+        for pos in bricks:
+            tile_data = mario4k.PatternTable.make_tile("brick")
+            surface.blit(mario4k.PatternTable.render_tile(tile_data, pal), pos)
+
+    def screen_cached():
+        for pos in bricks:
+            atlas.blit(surface, "brick", pal, pos)
+
+    report(f"screen of {len(bricks)} bricks", timeit(screen_uncached, 20),
+           timeit(screen_cached, 200))
+    print(f"atlas: {len(atlas.slots)} tiles in "
+          f"{atlas.surface.get_width()}x{atlas.surface.get_height()}")
+
+
+# ---------------------------------------------
+# Level draw while scrolling (Nametable)
+# ---------------------------------------------
+def bench_scroll(args):
+    surface = mario4k.DISPLAY
+    level = mario4k.NESLevel(0, 0)
+    cam = [0]
+
+    def scroll():
+        level.draw(surface, cam[0])
+        cam[0] = (cam[0] + 2) % (level.width * mario4k.TILE_SIZE - mario4k.NES_WIDTH)
+
+    def redraw():
+        level.nametable.invalidate()
+        level.draw(surface, cam[0])
+
+    report("level draw (2px/frame)", timeit(redraw, 200), timeit(scroll, 2000))
+
+
+# ---------------------------------------------
+# Text (set_at per pixel vs GlyphAtlas)
+# ---------------------------------------------
+def bench_text(args):
+    surface = mario4k.DISPLAY
+    color = mario4k.NES_PALETTE[0x30]
+    labels = ["WORLD", "TIME", "KOOPA", "000100", "1-1", "400"]
+
+    def per_pixel():
+        for text in labels:
+            for i, char in enumerate(text):
+                pattern = mario4k.FONT_DATA[char]
+                for row in range(8):
+                    for col in range(8):
+                        if pattern[row] & (1 << (7 - col)):
+                            surface.set_at((8 + i * 8 + col, 8 + row), color)
+
+    def cached():
+        for text in labels:
+            mario4k.FONT.draw(surface, text, 8, 8, color)
+
+    report("HUD labels", timeit(per_pixel, 200), timeit(cached, 2000))
+
+
+# ---------------------------------------------
+# Palette swaps (re-render vs palette write)
+# ---------------------------------------------
+def bench_palette(args):
+    surface = mario4k.DISPLAY
+    atlas = mario4k.TILE_ATLAS
+    level = mario4k.NESLevel(0, 0)
+    worlds = [pal['fg'] for pal in mario4k.WORLD_PALETTES]
+    turn = [0]
+
+    def recolor():
+        turn[0] += 1
+        atlas.set_palette("world", worlds[turn[0] % len(worlds)])
+
+    def rerender():
+        # What a world change used to cost: fresh tiles and a full redraw
+        recolor()
+        atlas.invalidate("world")
+        level.tile_rects()
+        level.nametable.invalidate()
+        level.draw(surface, 0)
+
+    def swap():
+        recolor()
+        level.draw(surface, 0)
+
+    report("world palette swap", timeit(rerender, 200), timeit(swap, 2000))
+
+    def redraw_frame():
+        atlas.set_frame("question", turn[0])
+        turn[0] += 1
+        level.nametable.invalidate()
+        level.nametable.draw(surface, 0)
+
+    def cycle_frame():
+        atlas.set_frame("question", turn[0])
+        turn[0] += 1
+        level.nametable.draw(surface, 0)
+
+    report("question block frame", timeit(redraw_frame, 200),
+           timeit(cycle_frame, 2000))
+    print(f"bank: {atlas.entries} palette entries, {len(atlas.slots)} tiles")
+
+    # Dropping a cycle or the whole bank must not break the next draw
+    for palette in ("question", "world", None):
+        atlas.invalidate(palette)
+        level.draw(surface, 0)
+    assert "question" in atlas.cycles and "world" in atlas.palettes
+
+    # Released neighbours merge into one block, and a block at the top of
+    # the bank lowers the high-water mark instead of lingering in spare
+    for i in range(4):
+        atlas.set_palette(("bench", i), worlds[i % len(worlds)])
+    atlas.set_palette("bench_top", worlds[0])
+    first = atlas.palettes[("bench", 0)][0]
+    for i in (1, 3, 0, 2):
+        atlas.invalidate(("bench", i))
+    assert atlas.spare == [(first, 16)], atlas.spare
+    atlas.invalidate("bench_top")
+    assert not atlas.spare and atlas.entries == first, (atlas.spare, atlas.entries)
+
+
+# ---------------------------------------------
+# APU synthesis per second of audio
+# ---------------------------------------------
+def bench_audio(args):
+    apu = mario4k.BootlegAPU()
+    rate = apu.sample_rate
+
+    def square_loop():
+        period = rate / 440.0
+        wave = []
+        for i in range(rate):
+            phase = (i % period) / period
+            wave.append(127 if phase < 0.5 else -128)
+        struct.pack('b' * len(wave), *wave)
+
+    def triangle_loop():
+        period = rate / 440.0
+        wave = []
+        for i in range(rate):
+            phase = (i % period) / period
+            wave.append(int((abs(4 * phase - 2) - 1) * 64))
+        struct.pack('b' * len(wave), *wave)
+
+    def noise_loop():
+        wave = []
+        lfsr = 1
+        counter = 0
+        for i in range(rate):
+            counter += 1
+            if counter >= 16:
+                counter = 0
+                bit0 = lfsr & 1
+                bit1 = (lfsr >> 1) & 1
+                lfsr >>= 1
+                if bit0 ^ bit1:
+                    lfsr |= 0x4000
+            wave.append(64 if lfsr & 1 else -64)
+        struct.pack('b' * len(wave), *wave)
+
+    backend = "numpy" if mario4k.numpy is not None else "array"
+    report(f"square 1s ({backend})", timeit(square_loop, 10),
+           timeit(lambda: apu.square_samples(440.0, 1.0), 50))
+    report(f"triangle 1s ({backend})", timeit(triangle_loop, 10),
+           timeit(lambda: apu.triangle_samples(440.0, 1.0), 50))
+    report("noise 1s", timeit(noise_loop, 10),
+           timeit(lambda: apu.noise_samples(1.0), 50))
+    if apu.enabled:
+        apu.cache.clear()
+        report("make_square_wave (cached)",
+               timeit(lambda: apu.square_samples(440.0, 0.2), 200),
+               timeit(lambda: apu.make_square_wave(440.0, 0.2), 2000))
+
+
+# ---------------------------------------------
+# Level generation (list of lists vs flat bytearray)
+# ---------------------------------------------
+def legacy_tilemap(world, level_num, width, height=30):
+    """The old cell-by-cell generator, kept as the baseline"""
+    random.seed(world * 100 + level_num)
+    tilemap = [[0 for _ in range(width)] for _ in range(height)]
+    pipes = []
+    for x in range(width):
+        h = 25 + int(math.sin(x * 0.1) * 2)
+        for y in range(h, height):
+            tilemap[y][x] = 1
+        if x % 20 == 10:
+            platform_y = h - random.randint(5, 10)
+            if platform_y > 10:
+                for dx in range(5):
+                    if x + dx < width:
+                        tilemap[platform_y][x + dx] = 1
+        if x % 35 == 20:
+            pipe_height = random.randint(3, 6)
+            pipes.append((x, max(0, h - pipe_height)))
+            for dy in range(pipe_height):
+                y = h - 1 - dy
+                if y >= 0:
+                    tilemap[y][x] = 2
+                    if x + 1 < width:
+                        tilemap[y][x + 1] = 2
+        if x % 15 == 7:
+            block_y = h - random.randint(4, 8)
+            if block_y > 10:
+                tilemap[block_y][x] = 3
+    for x, top in pipes:
+        for col in range(max(x - mario4k.PIPE_APPROACH, 0), min(x + 2, width)):
+            h = 25 + int(math.sin(col * 0.1) * 2)
+            for y in range(max(0, top - mario4k.PIPE_HEADROOM), h):
+                if tilemap[y][col] != 2:
+                    tilemap[y][col] = 0
+    return tilemap
+
+
+def bench_generate(args):
+    for width in (256, 2560, 25600):
+        level = mario4k.NESLevel(0, 0, width=width)
+        legacy = legacy_tilemap(0, 0, width)
+        assert bytes(v for row in legacy for v in row) == bytes(level.tilemap)
+        legacy_bytes = sys.getsizeof(legacy) + sum(sys.getsizeof(row) for row in legacy)
+        repeat = max(1, 2560 // width)
+        report(f"generate {width} columns",
+               timeit(lambda: legacy_tilemap(0, 0, width), repeat) / 1000,
+               timeit(level.generate, repeat) / 1000, "ms")
+        print(f"{'':<28} tilemap {legacy_bytes:>9} bytes -> "
+              f"{sys.getsizeof(level.tilemap):>9} bytes")
+
+
+# ---------------------------------------------
+# Level files (generate vs mmap load)
+# ---------------------------------------------
+def bench_levels(args):
+    with tempfile.TemporaryDirectory() as directory:
+        for width in (256, 25600):
+            path = os.path.join(directory, f"bench-{width}.lvl")
+            mario4k.save_level(mario4k.NESLevel(0, 0, width=width), path)
+            repeat = max(1, 2560 // width)
+            report(f"open {width} column level",
+                   timeit(lambda: mario4k.NESLevel(0, 0, width=width), repeat) / 1000,
+                   timeit(lambda: mario4k.load_level(path), repeat) / 1000, "ms")
+            print(f"{'':<28} file {os.path.getsize(path)} bytes")
+
+
+# ---------------------------------------------
+# Streaming levels (chunk cost, flat memory)
+# ---------------------------------------------
+def bench_streaming(args):
+    level = mario4k.StreamingLevel(0, 0)
+    chunk_px = level.CHUNK * mario4k.TILE_SIZE
+    cam = 0
+    
+    def advance():
+        nonlocal cam
+        cam += chunk_px
+        level.stream(cam)
+    
+    print(f"{'stream one chunk':<28} {timeit(advance, 200) / 1000:9.2f}ms")
+    
+    # Resident memory after 100 vs 2000 more chunks scrolled past
+    tracemalloc.start()
+    start = cam
+    for chunks in (100, 2000):
+        while cam < start + chunks * chunk_px:
+            cam += chunk_px // 4
+            level.stream(cam)
+        gc.collect()
+        print(f"{chunks:>5} chunks scrolled  traced {tracemalloc.get_traced_memory()[0]:8d} bytes  "
+              f"resident {len(level.chunks)} chunks, {len(level.enemies)} koopas")
+    tracemalloc.stop()
+
+# ---------------------------------------------
+# Sprites (per-entity blits vs one OAM batch)
+# ---------------------------------------------
+def bench_sprites(args):
+    surface = mario4k.DISPLAY
+    sprite, flipped = mario4k.SPRITES.get("koopa", 0)
+    rng = random.Random(7)
+    placed = [(rng.randrange(-16, mario4k.NES_WIDTH), rng.randrange(24, 200), i % 2)
+              for i in range(64)]
+    
+    def per_entity():
+        for x, y, flip in placed:
+            # Old SpriteOAM.render flipped on every call
+            surface.blit(pygame.transform.flip(sprite, True, False) if flip else sprite, (x, y))
+    
+    def batched():
+        for x, y, flip in placed:
+            oam.add_sprite(x, y, sprite, flip_h=bool(flip))
+        oam.render(surface)
+    
+    oam = mario4k.SpriteOAM()
+    report("64 sprites, OAM batch", timeit(per_entity, 500), timeit(batched, 500))
+    oam.scanline_limit = True
+    print(f"{'  + 8/scanline limit':<28} {timeit(batched, 500):18.2f}us")
+
+# ---------------------------------------------
+# Presentation (full scale + flip vs dirty rects)
+# ---------------------------------------------
+def bench_present(args):
+    mario4k.APU.enabled = False
+    display = mario4k.DISPLAY
+    full, dirty = mario4k.Presenter(), mario4k.Presenter()
+    dirty.set_dirty_rects(True)
+    engine = make_engine(0, [mario4k.BUTTON_B | mario4k.BUTTON_RIGHT])
+    
+    def scenario(step):
+        frames = []
+        for _ in range(60):
+            step()
+            frames.append(display.copy())
+        return frames
+    
+    def play():
+        engine.update()
+        engine.state = "GAME"
+        engine.draw()
+    
+    def game_over():
+        engine.state = "GAMEOVER"
+        engine.draw()
+    
+    for name, step in (("scrolling play", play), ("static GAMEOVER", game_over)):
+        frames = scenario(step)
+        
+        def present(presenter):
+            for frame in frames:
+                display.blit(frame, (0, 0))
+                presenter.present(display)
+        
+        report(f"present {name}", timeit(lambda: present(full), 5) / len(frames),
+               timeit(lambda: present(dirty), 5) / len(frames))
+
+# ---------------------------------------------
+# Upscalers (each backend at 2x, 3x, 4x)
+# ---------------------------------------------
+def bench_upscale(args):
+    mario4k.APU.enabled = False
+    engine = make_engine(0, [mario4k.BUTTON_B | mario4k.BUTTON_RIGHT])
+    for _ in range(120):
+        engine.update()
+    engine.draw()
+    presenter = mario4k.PRESENTER
+    default = (presenter.upscaler.scale, presenter.upscaler.NAME)
+    print(f"{'backend':<10}" + "".join(f"{f'{scale}x':>12}" for scale in (2, 3, 4)))
+    for name in mario4k.UPSCALERS:
+        row = f"{name:<10}"
+        for scale in (2, 3, 4):
+            presenter.configure(scale, name)
+            row += f"{timeit(lambda: presenter.present_full(mario4k.DISPLAY), 200):10.1f}us"
+        print(row)
+    presenter.configure(*default)
+
+# ---------------------------------------------
+# Frame-time suite (per phase, seeded scenarios)
+# ---------------------------------------------
+PHASES = ("update", "level", "entities", "hud", "present")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def make_engine(world, input_masks, stress=0):
+    """Seeded engine in GAME state (or TITLE when world is None)"""
+    random.seed(1234)
+    engine = mario4k.KoopaEngine(mario4k.ScriptedInput(input_masks, loop=True))
+    if world is not None:
+        engine.state = "GAME"
+        engine.world = world
+        engine.start_level()
+        engine.player.lives = 99  # Keep the scenario in GAME
+        if stress:
+            # Every stress koopa starts on the first screen and stays awake:
+            # the window spans the whole level, so none despawn as it scrolls
+            level = engine.level
+            level.ACTIVE_MARGIN = level.width * mario4k.TILE_SIZE
+            for i in range(stress):
+                x = random.randrange(0, mario4k.NES_WIDTH)
+                level.spawns.append((x, random.randrange(100, 180), engine.world))
+            level.spawn_enemies()  # Re-sort the spawn index
+    return engine
+
+
+def run_scenario(engine, frames):
+    """Time each phase of update + draw through the engine's own render steps"""
+    clock = time.perf_counter
+    samples = {phase: [] for phase in PHASES}
+    samples["frame"] = []
+    awake = []
+    for _ in range(frames):
+        t0 = clock()
+        engine.update()
+        t1 = clock()
+        engine.render_level()
+        t2 = clock()
+        engine.render_entities()
+        t3 = clock()
+        engine.render_hud()
+        t4 = clock()
+        engine.present()
+        t5 = clock()
+        for phase, elapsed in zip(PHASES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+            samples[phase].append(elapsed * 1000)
+        samples["frame"].append((t5 - t0) * 1000)
+        awake.append(engine.level.enemies.count if engine.level else 0)
+
+    result = {}
+    for phase, values in samples.items():
+        values.sort()
+        result[phase] = {
+            "median_ms": round(statistics.median(values), 4),
+            "p95_ms": round(percentile(values, 95), 4),
+            "p99_ms": round(percentile(values, 99), 4),
+        }
+    awake.sort()
+    result["awake"] = {"median": statistics.median(awake), "min": awake[0], "max": awake[-1]}
+    result["state"] = engine.state
+    return result
+
+
+def bench_frames(args):
+    mario4k.APU.enabled = False  # Keep the mixer closed
+    run = mario4k.BUTTON_B | mario4k.BUTTON_RIGHT
+    scenarios = {
+        "title": lambda: make_engine(None, [0]),
+        "world_1_1_run": lambda: make_engine(0, [run]),
+        "underground": lambda: make_engine(1, [run]),
+        "enemy_stress": lambda: make_engine(0, [run], stress=5000),
+    }
+    results = {}
+    for name, factory in scenarios.items():
+        results[name] = run_scenario(factory(), args.frames)
+        print(f"{name}:")
+        for phase in PHASES + ("frame",):
+            stats = results[name][phase]
+            print(f"  {phase:<9} median {stats['median_ms']:8.3f}ms  "
+                  f"p95 {stats['p95_ms']:8.3f}ms  p99 {stats['p99_ms']:8.3f}ms")
+        awake = results[name]["awake"]
+        print(f"  awake     median {awake['median']:6g}  min {awake['min']:6d}  max {awake['max']:6d}")
+    if args.json:
+        report_data = {
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "frames": args.frames,
+            "scenarios": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report_data, f, indent=2, sort_keys=True)
+        print(f"wrote {args.json}")
+
+
+# ---------------------------------------------
+# Frame pacing (tick-per-draw vs FrameTimer)
+# ---------------------------------------------
+def bench_pacing(args):
+    # Simulated clock: each draw costs draw_ms, one wall-clock second per run
+    for draw_ms in (8, 25, 50):
+        cost = draw_ms / 1000
+        now = [0.0]
+        timer = mario4k.FrameTimer(clock=lambda: now[0])
+        steps = 0
+        while now[0] < 1.0:
+            steps += timer.advance()
+            now[0] += cost  # Draw
+            timer.rendered()
+            now[0] = max(now[0], timer.last + timer.STEP - timer.accumulator)  # Wait
+        tied = 1.0 / max(cost, timer.STEP)  # Old loop: one update per tick(FPS)
+        print(f"draw {draw_ms:2d}ms: game speed tied {tied / mario4k.FPS:4.0%}  "
+              f"fixed {steps / mario4k.FPS:4.0%}  "
+              f"({timer.skipped} renders skipped, {timer.dropped} steps dropped)")
+
+    # Real clock: pacing accuracy of sleep() against a busy-wait tail
+    for busy_wait in (False, True):
+        timer = mario4k.FrameTimer(busy_wait=busy_wait)
+        for _ in range(60):
+            timer.advance()
+            timer.rendered()
+            timer.wait()
+        stats = timer.stats()
+        print(f"{'busy-wait' if busy_wait else 'sleep':<9} frame {stats['mean_ms']:6.2f}ms  "
+              f"jitter {stats['jitter_ms']:5.2f}ms  worst {stats['worst_ms']:6.2f}ms")
+
+
+# ---------------------------------------------
+# Save states and rewind (full blobs vs keyframe deltas)
+# ---------------------------------------------
+def bench_rewind(args):
+    mario4k.APU.enabled = False  # Keep the mixer closed
+    run = mario4k.BUTTON_B | mario4k.BUTTON_RIGHT
+    for name, stress in (("world_1_1_run", 0), ("enemy_stress", 500)):
+        engine = make_engine(0, [run, run | mario4k.BUTTON_A], stress=stress)
+        for _ in range(120):
+            engine.update()
+        state = mario4k.save_state(engine)
+        save_us = timeit(lambda: mario4k.save_state(engine), 500)
+        load_us = timeit(lambda: mario4k.load_state(engine, state), 500)
+        print(f"{name}: {len(state)} byte state, {len(engine.level.enemies)} koopas, "
+              f"save {save_us:.1f}us  load {load_us:.1f}us")
+
+        rewind = mario4k.RewindBuffer()
+        full = 0
+        frames = 600
+        start = time.perf_counter()
+        for _ in range(frames):
+            engine.update()
+            rewind.record(engine)
+            full += len(mario4k.save_state(engine))
+        per_frame = (time.perf_counter() - start) / frames * 1e6
+        report("  rewind KB per minute", full / frames * 3600 / 1024,
+               rewind.nbytes / len(rewind) * 3600 / 1024, "KB")
+        print(f"  update + record {per_frame:.1f}us/frame, "
+              f"{rewind.nbytes / len(rewind):.0f} bytes/frame")
+
+
+# ---------------------------------------------
+# Level file and save state formats (round trips, version bumps)
+# ---------------------------------------------
+# Output digest per version. A mismatch means the output changed: bump the
+# version in mario4k.py and record the new digest here.
+GENERATOR_DIGESTS = {  # Generated tiles and spawns
+    1: "5e1e92e0462f6587ea7ad45ad5e0cf0c",
+    2: "ba3e6c22c3ab5fb32e69deb08bafad03",
+}
+LEVEL_FORMAT_DIGESTS = {  # save_level() of a hand-built level
+    1: "706ff789fe27711de8fdd799096eb994",
+    2: "713ed1afffcf7c7cdbb0ca983cba1dc7",
+}
+STATE_FORMAT_DIGESTS = {1: "e371eb11e59212500a170da3874568e8"}  # save_state() of hand-set engines
+
+
+def check_digest(digests, version, name, data):
+    digest = hashlib.md5(data).hexdigest()
+    expected = digests.get(version)
+    assert digest == expected, (
+        f"{name} output changed (digest {digest}, recorded {expected} for version "
+        f"{version}): bump {name} in mario4k.py and record the new digest in bench.py")
+
+
+def reference_engine(endless):
+    """Engine in GAME with hand-set fields - never updated, so the state
+    does not depend on game logic"""
+    engine = mario4k.KoopaEngine(mario4k.ScriptedInput([0]), endless)
+    engine.state = "GAME"
+    engine.start_game()
+    engine.camera_x = 96.5
+    engine.frame_counter = 1234
+    engine.score = 5600
+    engine.time = 321
+    player = engine.player
+    player.x, player.y, player.vx, player.vy = 180.25, 150.0, 1.5, -2.75
+    player.lives = 2
+    engine.level.enemies.spawn(220, 180, 1)
+    engine.level.set_tile(30, 20, 3)
+    return engine
+
+
+def bench_formats(args):
+    mario4k.APU.enabled = False  # Keep the mixer closed
+    generated = []
+    for world, level_num in ((0, 0), (1, 2), (3, 1)):
+        level = mario4k.NESLevel(world, level_num)
+        generated += [bytes(level.tilemap), repr(level.spawns).encode()]
+    stream = mario4k.StreamingLevel(0, 1)
+    generated += [stream.generate_chunk(index) for index in range(4)]
+    check_digest(GENERATOR_DIGESTS, mario4k.GENERATOR_VERSION, "GENERATOR_VERSION",
+                 b"".join(generated))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "level.lvl")
+        for world, level_num in ((0, 0), (2, 3)):
+            level = mario4k.NESLevel(world, level_num)
+            mario4k.save_level(level, path)
+            with open(path, "rb") as f:
+                data = f.read()
+            loaded = mario4k.load_level(path)
+            assert bytes(loaded.tilemap) == bytes(level.tilemap)
+            for table in ("solid", "floor_index", "surface"):
+                assert bytes(getattr(loaded, table)) == bytes(getattr(level, table)), table
+            assert list(loaded.spawns) == list(level.spawns)
+            mario4k.save_level(loaded, path)
+            with open(path, "rb") as f:
+                assert f.read() == data, "level file does not round-trip"
+        tilemap = bytes(i % 4 for i in range(4 * 30))
+        mario4k.save_level(mario4k.NESLevel(1, 2, width=4, tilemap=tilemap,
+                                            spawns=[(20, 180, 0), (300, 170, 2)]), path)
+        with open(path, "rb") as f:
+            data = f.read()
+        # The header's generator version is GENERATOR_DIGESTS' business
+        header = list(mario4k.LEVEL_HEADER.unpack_from(data))
+        header[2] = 0
+        check_digest(LEVEL_FORMAT_DIGESTS, mario4k.LEVEL_FORMAT, "LEVEL_FORMAT",
+                     mario4k.LEVEL_HEADER.pack(*header) + data[mario4k.LEVEL_HEADER.size:])
+    print("level files: round trip byte-exact, generator and format versions current")
+
+    states = []
+    for endless in (False, True):
+        engine = reference_engine(endless)
+        state = mario4k.save_state(engine)
+        restored = mario4k.KoopaEngine(mario4k.ScriptedInput([0]), endless)
+        mario4k.load_state(restored, state)
+        assert mario4k.save_state(restored) == state, "save state does not round-trip"
+        states.append(state)
+
+        # A played run, restored into a fresh engine and into itself
+        engine = mario4k.KoopaEngine(mario4k.ScriptedInput.demo(), endless)
+        for _ in range(400):
+            engine.update()
+        engine.level.set_tile(int(engine.player.x) // mario4k.TILE_SIZE + 3, 20, 3)
+        state = mario4k.save_state(engine)
+        restored = mario4k.KoopaEngine(mario4k.ScriptedInput.demo(), endless)
+        mario4k.load_state(restored, state)
+        assert mario4k.save_state(restored) == state, "save state does not round-trip"
+        trace = []
+        for _ in range(300):
+            engine.update()
+            restored.update()
+            trace.append(mario4k.save_state(engine))
+            assert trace[-1] == mario4k.save_state(restored), "restored run diverged"
+        mario4k.load_state(engine, state)
+        assert mario4k.save_state(engine) == state, "save state does not round-trip"
+        for frame in trace:
+            engine.update()
+            assert mario4k.save_state(engine) == frame, "run restored in place diverged"
+        print(f"save state ({'endless' if endless else 'fixed'}): round trip byte-exact, "
+              f"restored runs in step for {len(trace)} frames, {len(state)} bytes")
+    check_digest(STATE_FORMAT_DIGESTS, mario4k.STATE_FORMAT, "STATE_FORMAT", b"".join(states))
+    print("save state format version current")
+
+
+# ---------------------------------------------
+# Vectorized environment throughput
+# ---------------------------------------------
+def bench_vector(args):
+    mario4k.APU.enabled = False  # Keep the mixer closed
+    run = mario4k.BUTTON_B | mario4k.BUTTON_RIGHT
+    hop = run | mario4k.BUTTON_A
+    steps = 100
+
+    # One in-process engine, updating and drawing (presenting) every frame
+    engine = make_engine(0, [run] * 20 + [hop] * 20)
+    start = time.perf_counter()
+    for _ in range(steps):
+        engine.update()
+        engine.draw()
+    print(f"single engine, update + draw   {steps / (time.perf_counter() - start):8.0f} fps")
+
+    cpus = os.cpu_count() or 1
+    for observation, frameskip in (("pixels", 1), ("pixels", 4), ("tiles", 4)):
+        for count in sorted({cpus, 4 * cpus}):
+            with mario4k.VectorEnv(count, observation=observation, frameskip=frameskip) as env:
+                env.reset()
+                start = time.perf_counter()
+                for step in range(steps):
+                    env.step([hop if (step + i) % 40 < 20 else run for i in range(count)])
+                elapsed = time.perf_counter() - start
+            print(f"{count:3d} engines/{cpus} cpus, {observation:<6} skip {frameskip}  "
+                  f"{count * steps * frameskip / elapsed:8.0f} fps  "
+                  f"({count * steps / elapsed:6.0f} observations/s)")
+
+
+# ---------------------------------------------
+# Frame capture (synchronous write vs ring + writer thread)
+# ---------------------------------------------
+def bench_capture(args):
+    surface = mario4k.DISPLAY
+    engine = make_engine(0, [mario4k.BUTTON_B | mario4k.BUTTON_RIGHT])
+    for _ in range(60):
+        engine.update()
+    engine.render()
+    frames = 120
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt in mario4k.FrameCapture.FORMATS:
+            path = os.path.join(directory, "sync." + fmt)
+            os.makedirs(path, exist_ok=True)
+            with open(path + ".raw", "wb") as f:
+                n = [0]
+
+                def sync():
+                    if fmt == "raw":
+                        f.write(pygame.image.tobytes(surface, "RGBX"))
+                    else:
+                        pygame.image.save(surface, os.path.join(path, f"{n[0]:06d}.png"))
+                    n[0] += 1
+
+                before = timeit(sync, frames)
+
+            # Paced like the game: grab, then leave the rest of a frame idle
+            capture = mario4k.FrameCapture()
+            capture.start(os.path.join(directory, "async." + fmt), fmt)
+            cost = []
+            for _ in range(frames):
+                start = time.perf_counter()
+                capture.grab(surface)
+                cost.append(time.perf_counter() - start)
+                time.sleep(max(0, 1 / mario4k.FPS - cost[-1]))
+            stats = capture.stop()
+            report(f"{fmt} capture, game thread", before,
+                   statistics.median(cost) * 1e6)
+            print(f"  {stats['written']} written, {stats['dropped']} dropped at 60fps, "
+                  f"worst grab {max(cost) * 1e6:.0f}us")
+
+
+# ---------------------------------------------
+# Startup (blocking music intro, time to first frame)
+# ---------------------------------------------
+def legacy_music(apu):
+    """The old intro: play each note, then wait it out"""
+    for note in [261.63, 293.66, 329.63, 349.23, 392.00, 440.00]:
+        sound = apu.make_square_wave(note, 0.2)
+        if sound:
+            sound.play()
+            pygame.time.wait(200)
+
+
+def bench_startup(args):
+    apu = mario4k.BootlegAPU()
+    if apu.open():
+        # Both sides play already synthesized sounds
+        legacy_music(apu)
+        apu.play_bootleg_music(0)
+        report("music intro (start_level)", timeit(lambda: legacy_music(apu), 1) / 1000,
+               timeit(lambda: apu.play_bootleg_music(0), 50) / 1000, "ms")
+        pygame.mixer.stop()
+
+    # Fresh interpreters, up to the first presented frame
+    runs = []
+    for _ in range(5):
+        out = subprocess.run([sys.executable, mario4k.__file__, "--headless", "--frames", "1",
+                              "--render", "--startup-profile"],
+                             capture_output=True, text=True, check=True).stdout
+        lines = out.splitlines()
+        lines = lines[next(i for i, line in enumerate(lines) if line.startswith("startup:")):]
+        runs.append((float(lines[0].split()[1][:-2]), lines))
+    runs.sort()
+    total, lines = runs[len(runs) // 2]
+    print(f"time to first frame, median of {len(runs)} cold starts: {total:.1f}ms")
+    print("\n".join(lines[1:]))
+
+
+BENCHMARKS = {
+    "tiles": bench_tiles,
+    "scroll": bench_scroll,
+    "text": bench_text,
+    "palette": bench_palette,
+    "audio": bench_audio,
+    "generate": bench_generate,
+    "levels": bench_levels,
+    "streaming": bench_streaming,
+    "sprites": bench_sprites,
+    "present": bench_present,
+    "upscale": bench_upscale,
+    "frames": bench_frames,
+    "pacing": bench_pacing,
+    "rewind": bench_rewind,
+    "formats": bench_formats,
+    "vector": bench_vector,
+    "capture": bench_capture,
+    "startup": bench_startup,
+}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Koopa Engine benchmarks")
+    parser.add_argument("names", nargs="*", metavar="NAME",
+                        help=f"benchmarks to run ({', '.join(BENCHMARKS)})")
+    parser.add_argument("--frames", type=int, default=600,
+                        help="frames per scenario for the frame-time suite")
+    parser.add_argument("--json", metavar="FILE",
+                        help="write frame-time results as JSON")
+    args = parser.parse_args(argv)
+    names = args.names or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"unknown benchmark {name!r}, choose from: {', '.join(BENCHMARKS)}")
+            return 1
+    for name in names:
+        print(f"--- {name} ---")
+        BENCHMARKS[name](args)
+    pygame.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -3,11 +3,32 @@
 # 256x240 NES Resolution, 8-bit limitations, Koopa Everything!
 # files=off, 100% procedural, byte-accurate NES feel
 
+import argparse
+import bisect
+import mmap
+import os
+import queue
+import signal
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+IMPORT_START = time.perf_counter()  # Startup profile zero
 import pygame
+PYGAME_IMPORTED = time.perf_counter()
 import math
 import random
 import struct
-import time
+import zlib
+from array import array
+from collections import OrderedDict, deque
+
+try:
+    import numpy
+except ImportError:  # Pure Python synthesis fallback
+    numpy = None
 
 # --- NES Hardware Constants ---
 NES_WIDTH = 256
@@ -17,14 +38,19 @@ FPS = 60  # NTSC
 TILE_SIZE = 8  # NES uses 8x8 tiles
 SPRITE_SIZE = 16  # 8x16 sprite mode
 
-# NES APU init (bootleg quality)
-pygame.mixer.pre_init(11025, -8, 1, 128)  # Low quality for authentic bootleg sound
-pygame.init()
+# Tile collision
+SOLID_TILES = b'\x00' + b'\x01' * 255  # Translate table: any tile id > 0 is solid
+STEP_HEIGHT = TILE_SIZE  # Walkers climb one-tile steps
+LEDGE_DROP = 2  # Koopas turn back at drops of 2+ tiles
+PIPE_APPROACH = 6  # Columns before a pipe kept clear overhead for a running jump
+PIPE_HEADROOM = 3  # Rows kept clear above a pipe top (the player is 2 tall)
+KEEP_PIPES = b'\x00\x00\x02' + b'\x00' * 253  # Translate table: clears all but pipe tiles
 
-SCREEN = pygame.display.set_mode((NES_WIDTH * SCALE, NES_HEIGHT * SCALE))
-DISPLAY = pygame.Surface((NES_WIDTH, NES_HEIGHT)).convert()
-pygame.display.set_caption("KOOPA ENGINE ◆ TEAM HUMMER STYLE")
-CLOCK = pygame.time.Clock()
+CAPTION = "KOOPA ENGINE ◆ TEAM HUMMER STYLE"
+
+# Window and frame buffer - opened by init(), nothing happens on import
+SCREEN = None
+DISPLAY = None
 
 # ---------------------------------------------
 # NES Palette (PPU 2C02)
@@ -162,67 +188,415 @@ class PatternTable:
                 surf.fill(color, rect)
         return surf
 
+
+class TileAtlas:
+    """CHR bank - each tile stored once, as palette indices in an 8-bit surface
+    
+    A tile's pixels index a block of bank palette entries (its
+    sub-palette). Sub-palettes are keyed by a tuple of NES colors (fixed,
+    shared by equal tuples) or by a name (recolorable, like the world
+    palette). Recoloring, palette cycles and the question block animation
+    are a few palette writes - no pixels are re-rendered, and surfaces
+    sharing the bank palette (the nametable) follow along. The bank has
+    255 entries: invalidate() sub-palettes that are done with to hand
+    their entries back.
+    """
+    
+    COLUMNS = 16  # 8x8 slots per atlas row
+    COLORKEY = 255  # Bank entry reserved for transparent cells
+    
+    def __init__(self, rows=4):
+        self.rows = 0
+        self.surface = None
+        self.slots = {}  # (pattern_type, palette) -> Rect into self.surface
+        self.free = []
+        self.colors = [(0, 0, 0)] * 256  # Bank palette, RGB per entry
+        self.colors[self.COLORKEY] = (255, 0, 255)
+        self.entries = 0  # Bank palette entries in use or released (high-water mark)
+        self.spare = []  # Sorted, merged (first entry, count) blocks released by invalidate()
+        self.epoch = 0  # Bumped when entries are released - index copies must redraw
+        self.palettes = {}  # palette key -> (first entry, NES colors)
+        self.cycles = {}  # name -> [first entry, per-frame NES colors, frame]
+        self.version = 0  # Bumped on every bank palette change
+        self._grow(rows)
+    
+    def _grow(self, rows):
+        """Add more 8x8 slots, keeping already stored tiles"""
+        old = self.surface
+        self.surface = pygame.Surface((self.COLUMNS * TILE_SIZE,
+                                       (self.rows + rows) * TILE_SIZE), 0, 8)
+        self.surface.set_palette(self.colors)
+        if old is not None:
+            self.surface.blit(old, (0, 0))  # Same palette - a straight copy
+        for y in range(self.rows + rows - 1, self.rows - 1, -1):
+            for x in range(self.COLUMNS - 1, -1, -1):
+                self.free.append(pygame.Rect(x * TILE_SIZE, y * TILE_SIZE,
+                                             TILE_SIZE, TILE_SIZE))
+        self.rows += rows
+    
+    def _allocate(self, count):
+        for i, (first, size) in enumerate(self.spare):
+            if size >= count:
+                if size == count:
+                    del self.spare[i]
+                else:
+                    self.spare[i] = (first + count, size - count)
+                return first
+        first = self.entries
+        if first + count > self.COLORKEY:
+            raise ValueError("CHR bank palette is full - invalidate() unused palettes")
+        self.entries += count
+        return first
+    
+    def _release(self, first, count):
+        # Keep spare sorted and merged so released neighbours form one block
+        i = bisect.bisect(self.spare, (first, count))
+        if i < len(self.spare) and first + count == self.spare[i][0]:
+            count += self.spare.pop(i)[1]
+        if i and self.spare[i - 1][0] + self.spare[i - 1][1] == first:
+            i -= 1
+            first, size = self.spare.pop(i)
+            count += size
+        if first + count == self.entries:
+            self.entries = first  # Top block - lower the high-water mark
+        else:
+            self.spare.insert(i, (first, count))
+        self.epoch += 1
+    
+    def _write(self, first, nes_colors):
+        for i, color in enumerate(nes_colors):
+            rgb = NES_PALETTE[min(max(0, color), len(NES_PALETTE) - 1)]
+            self.colors[first + i] = rgb
+            self.surface.set_palette_at(first + i, rgb)
+        self.version += 1
+    
+    def _slot(self, key):
+        if not self.free:
+            self._grow(self.rows)
+        rect = self.free.pop()
+        self.slots[key] = rect
+        return rect
+    
+    def set_palette(self, name, palette):
+        """Recolor a named sub-palette (4 palette writes, no pixels)"""
+        palette = tuple(palette)
+        entry = self.palettes.get(name)
+        if entry is None:
+            self.palettes[name] = (self._allocate(4), palette)
+        elif entry[1] == palette:
+            return
+        else:
+            self.palettes[name] = (entry[0], palette)
+        self._write(self.palettes[name][0], palette)
+    
+    def get(self, pattern_type, palette):
+        """Atlas rect for a tile, storing it on first use
+        
+        palette is a tuple of NES colors or the name given to set_palette().
+        """
+        if not isinstance(palette, str):
+            palette = tuple(palette)
+            if palette not in self.palettes:
+                self.set_palette(palette, palette)
+        key = (pattern_type, palette)
+        rect = self.slots.get(key)
+        if rect is None:
+            first, colors = self.palettes[palette]
+            rect = self._slot(key)
+            tile_data = PatternTable.make_tile(pattern_type)
+            for y, row in enumerate(tile_data):
+                for x, color_idx in enumerate(row):
+                    index = first + min(color_idx, len(colors) - 1)
+                    self.surface.set_at((rect.x + x, rect.y + y), index)
+            if PERF.enabled:
+                PERF.set_at += TILE_SIZE * TILE_SIZE
+        return rect
+    
+    def get_cycle(self, name, pattern_types, palette):
+        """Atlas rect for a tile that animates through pattern_types
+        
+        Each pixel indexes the distinct tuple of colors it takes across the
+        frames, so set_frame() can switch the whole animation with one
+        palette write per tuple.
+        """
+        key = (tuple(pattern_types), name)
+        rect = self.slots.get(key)
+        if rect is not None:
+            return rect
+        palette = tuple(palette)
+        tiles = [PatternTable.make_tile(pattern_type) for pattern_type in pattern_types]
+        pixels = [[tuple(palette[min(tile[y][x], len(palette) - 1)] for tile in tiles)
+                   for x in range(8)] for y in range(8)]
+        combos = sorted(set(combo for row in pixels for combo in row))
+        first = self._allocate(len(combos))
+        entry = {combo: first + i for i, combo in enumerate(combos)}
+        rect = self._slot(key)
+        for y, row in enumerate(pixels):
+            for x, combo in enumerate(row):
+                self.surface.set_at((rect.x + x, rect.y + y), entry[combo])
+        if PERF.enabled:
+            PERF.set_at += TILE_SIZE * TILE_SIZE
+        frames = [[combo[f] for combo in combos] for f in range(len(tiles))]
+        self.cycles[name] = [first, frames, None]
+        self.set_frame(name, 0)
+        return rect
+    
+    def set_frame(self, name, frame):
+        """Show one frame of a palette cycle"""
+        cycle = self.cycles[name]
+        frame %= len(cycle[1])
+        if cycle[2] != frame:
+            cycle[2] = frame
+            self._write(cycle[0], cycle[1][frame])
+    
+    def blit(self, surface, pattern_type, palette, pos):
+        surface.blit(self.surface, pos, self.get(pattern_type, palette))
+        if PERF.enabled:
+            PERF.blits += 1
+    
+    def invalidate(self, palette=None):
+        """Drop stored tiles for a palette or cycle name (or everything),
+        releasing its bank palette entries"""
+        if palette is None:
+            self.free.extend(self.slots.values())
+            self.slots.clear()
+            self.palettes.clear()
+            self.cycles.clear()
+            self.spare = []
+            self.entries = 0
+            self.epoch += 1
+            return
+        if not isinstance(palette, str):
+            palette = tuple(palette)
+        for key in list(self.slots):
+            if key[1] == palette:
+                self.free.append(self.slots.pop(key))
+        entry = self.palettes.pop(palette, None)
+        if entry is not None:
+            self._release(entry[0], 4)
+        cycle = self.cycles.pop(palette, None)
+        if cycle is not None:
+            self._release(cycle[0], len(cycle[1][0]))
+
+# ---------------------------------------------
+# NES Font (1-bit glyph bank)
+# ---------------------------------------------
+# NES-style 8x8 bitmap font patterns
+FONT_DATA = {
+    'A': [0x18,0x3C,0x66,0x7E,0x66,0x66,0x66,0x00],
+    'B': [0x7C,0x66,0x66,0x7C,0x66,0x66,0x7C,0x00],
+    'C': [0x3C,0x66,0x60,0x60,0x60,0x66,0x3C,0x00],
+    'D': [0x78,0x6C,0x66,0x66,0x66,0x6C,0x78,0x00],
+    'E': [0x7E,0x60,0x60,0x78,0x60,0x60,0x7E,0x00],
+    'F': [0x7E,0x60,0x60,0x78,0x60,0x60,0x60,0x00],
+    'G': [0x3C,0x66,0x60,0x6E,0x66,0x66,0x3C,0x00],
+    'H': [0x66,0x66,0x66,0x7E,0x66,0x66,0x66,0x00],
+    'I': [0x3C,0x18,0x18,0x18,0x18,0x18,0x3C,0x00],
+    'J': [0x1E,0x0C,0x0C,0x0C,0x0C,0x6C,0x38,0x00],
+    'K': [0x66,0x6C,0x78,0x70,0x78,0x6C,0x66,0x00],
+    'L': [0x60,0x60,0x60,0x60,0x60,0x60,0x7E,0x00],
+    'M': [0x63,0x77,0x7F,0x6B,0x63,0x63,0x63,0x00],
+    'N': [0x66,0x76,0x7E,0x7E,0x6E,0x66,0x66,0x00],
+    'O': [0x3C,0x66,0x66,0x66,0x66,0x66,0x3C,0x00],
+    'P': [0x7C,0x66,0x66,0x7C,0x60,0x60,0x60,0x00],
+    'Q': [0x3C,0x66,0x66,0x66,0x66,0x3C,0x0E,0x00],
+    'R': [0x7C,0x66,0x66,0x7C,0x78,0x6C,0x66,0x00],
+    'S': [0x3C,0x66,0x60,0x3C,0x06,0x66,0x3C,0x00],
+    'T': [0x7E,0x18,0x18,0x18,0x18,0x18,0x18,0x00],
+    'U': [0x66,0x66,0x66,0x66,0x66,0x66,0x3C,0x00],
+    'V': [0x66,0x66,0x66,0x66,0x66,0x3C,0x18,0x00],
+    'W': [0x63,0x63,0x63,0x6B,0x7F,0x77,0x63,0x00],
+    'X': [0x66,0x66,0x3C,0x18,0x3C,0x66,0x66,0x00],
+    'Y': [0x66,0x66,0x66,0x3C,0x18,0x18,0x18,0x00],
+    'Z': [0x7E,0x06,0x0C,0x18,0x30,0x60,0x7E,0x00],
+    '0': [0x3C,0x66,0x6E,0x76,0x66,0x66,0x3C,0x00],
+    '1': [0x18,0x18,0x38,0x18,0x18,0x18,0x7E,0x00],
+    '2': [0x3C,0x66,0x06,0x0C,0x30,0x60,0x7E,0x00],
+    '3': [0x3C,0x66,0x06,0x1C,0x06,0x66,0x3C,0x00],
+    '4': [0x06,0x0E,0x1E,0x66,0x7F,0x06,0x06,0x00],
+    '5': [0x7E,0x60,0x7C,0x06,0x06,0x66,0x3C,0x00],
+    '6': [0x3C,0x66,0x60,0x7C,0x66,0x66,0x3C,0x00],
+    '7': [0x7E,0x66,0x0C,0x18,0x18,0x18,0x18,0x00],
+    '8': [0x3C,0x66,0x66,0x3C,0x66,0x66,0x3C,0x00],
+    '9': [0x3C,0x66,0x66,0x3E,0x06,0x66,0x3C,0x00],
+    ' ': [0x00,0x00,0x00,0x00,0x00,0x00,0x00,0x00],
+    ':': [0x00,0x18,0x18,0x00,0x00,0x18,0x18,0x00],
+    '-': [0x00,0x00,0x00,0x7E,0x00,0x00,0x00,0x00],
+    '!': [0x18,0x18,0x18,0x18,0x00,0x00,0x18,0x00],
+    '(': [0x0E,0x18,0x30,0x30,0x30,0x18,0x0E,0x00],
+    ')': [0x70,0x18,0x0C,0x0C,0x0C,0x18,0x70,0x00],
+    '=': [0x00,0x00,0x7E,0x00,0x7E,0x00,0x00,0x00],
+    '/': [0x02,0x06,0x0C,0x18,0x30,0x60,0x40,0x00],
+    '.': [0x00,0x00,0x00,0x00,0x00,0x18,0x18,0x00],
+}
+
+class GlyphAtlas:
+    """1-bit glyph bank with a rendered string cache, colored by palette
+    
+    Strings stay 8-bit (index 0 unlit, 1 lit) and are cached by text alone;
+    drawing in a color is a write to palette entry 1, so one cached string
+    serves every color.
+    """
+    
+    COLORKEY = (255, 0, 255)  # Not in NES_PALETTE, marks unlit pixels
+    MAX_STRINGS = 256
+    
+    def __init__(self):
+        self.index = {char: i for i, char in enumerate(FONT_DATA)}
+        self.bank = None  # Built by the first render()
+        self.strings = OrderedDict()  # text -> rendered index surface
+    
+    def build_bank(self):
+        """8-bit surface used as a 1-bit bank: index 0 = unlit, 1 = lit"""
+        self.bank = pygame.Surface((len(FONT_DATA) * 8, 8), 0, 8)
+        self.bank.set_palette([self.COLORKEY, (255, 255, 255)])
+        self.bank.fill(0)
+        lit = 0
+        for char, i in self.index.items():
+            pattern = FONT_DATA[char]
+            for row in range(8):
+                for col in range(8):
+                    if pattern[row] & (1 << (7 - col)):
+                        self.bank.set_at((i * 8 + col, row), 1)
+                        lit += 1
+        if PERF.enabled:
+            PERF.set_at += lit
+    
+    def render(self, text):
+        """Rendered string surface (palette indices), cached by text"""
+        surf = self.strings.get(text)
+        if surf is not None:
+            self.strings.move_to_end(text)
+            return surf
+        if self.bank is None:
+            self.build_bank()
+        surf = pygame.Surface((max(1, len(text)) * 8, 8), 0, 8)
+        surf.set_palette(self.bank.get_palette())
+        surf.fill(0)
+        for i, char in enumerate(text.upper()):
+            glyph = self.index.get(char)
+            if glyph is not None:
+                surf.blit(self.bank, (i * 8, 0), (glyph * 8, 0, 8, 8))
+        surf.set_colorkey(0)
+        if PERF.enabled:
+            PERF.surfaces += 1
+            PERF.blits += sum(1 for char in text.upper() if char in self.index)
+        self.strings[text] = surf
+        if len(self.strings) > self.MAX_STRINGS:
+            self.strings.popitem(last=False)
+        return surf
+    
+    def draw(self, surface, text, x, y, color):
+        surf = self.render(text)
+        surf.set_palette_at(1, color)
+        surface.blit(surf, (x, y))
+        if PERF.enabled:
+            PERF.blits += 1
+
 # ---------------------------------------------
 # NES APU (Bootleg Sound)
 # ---------------------------------------------
 class BootlegAPU:
-    """Team Hummer style bootleg NES sound"""
+    """Team Hummer style bootleg NES sound
+    
+    The mixer is opened by the first sound, not at startup - runs that
+    never make a sound never pay for the audio device.
+    """
+    
+    CACHE_SIZE = 64  # Sounds kept around for reuse
     
     def __init__(self):
         self.sample_rate = 11025
-        self.enabled = pygame.mixer.get_init() is not None
-        
+        self.enabled = True  # Cleared if the mixer cannot be opened
+        self.cache = OrderedDict()  # (channel, freq, duration, duty) -> Sound
+    
+    def open(self):
+        """Start the mixer at bootleg quality, if not already running"""
+        if pygame.mixer.get_init() is not None:
+            return True
+        start = time.perf_counter()
+        try:
+            pygame.mixer.init(self.sample_rate, -8, 1, 128)  # Low quality for authentic bootleg sound
+        except pygame.error:
+            self.enabled = False
+            return False
+        STARTUP.lazy("audio", time.perf_counter() - start)
+        return True
+    
+    def _sound(self, key, synth):
+        """Cached mixer Sound, synthesizing the 8-bit samples on a miss"""
+        sound = self.cache.get(key)
+        if sound is not None:
+            self.cache.move_to_end(key)
+            return sound
+        if not self.open():
+            return None
+        sound = pygame.mixer.Sound(buffer=synth())
+        self.cache[key] = sound
+        if len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return sound
+    
+    def square_samples(self, freq, duration, duty=0.5):
+        """Signed 8-bit square wave samples"""
+        samples = int(self.sample_rate * duration)
+        period = self.sample_rate / freq
+        if numpy is not None:
+            phase = numpy.arange(samples) % period / period
+            return numpy.where(phase < duty, 127, -128).astype(numpy.int8).tobytes()
+        return array('b', [127 if (i % period) / period < duty else -128
+                           for i in range(samples)]).tobytes()
+    
+    def triangle_samples(self, freq, duration):
+        """Signed 8-bit triangle wave samples"""
+        samples = int(self.sample_rate * duration)
+        period = self.sample_rate / freq
+        if numpy is not None:
+            phase = numpy.arange(samples) % period / period
+            return ((numpy.abs(4 * phase - 2) - 1) * 64).astype(numpy.int8).tobytes()
+        return array('b', [int((abs(4 * ((i % period) / period) - 2) - 1) * 64)
+                           for i in range(samples)]).tobytes()
+    
+    def noise_samples(self, duration, freq_div=16):
+        """Signed 8-bit LFSR noise samples"""
+        samples = int(self.sample_rate * duration)
+        # The LFSR only clocks once per freq_div samples - step it per
+        # clock and repeat each output bit instead of looping per sample
+        steps = (samples + 1) // freq_div
+        lfsr = 1
+        bits = [1]
+        for _ in range(steps):
+            bit0 = lfsr & 1
+            bit1 = (lfsr >> 1) & 1
+            lfsr >>= 1
+            if bit0 ^ bit1:
+                lfsr |= 0x4000
+            bits.append(lfsr & 1)
+        high, low = b'\x40' * freq_div, b'\xc0' * freq_div
+        # First clock happens on sample freq_div - 1
+        data = b''.join([high if bit else low for bit in bits])
+        return data[1:samples + 1]
+    
     def make_square_wave(self, freq, duration, duty=0.5):
         """NES square wave channel"""
         if not self.enabled:
             return None
-        samples = int(self.sample_rate * duration)
-        wave = []
-        period = self.sample_rate / freq
-        for i in range(samples):
-            phase = (i % period) / period
-            wave.append(127 if phase < duty else -128)
-        
-        # Pack as 8-bit signed
-        data = struct.pack('b' * len(wave), *wave)
-        return pygame.mixer.Sound(buffer=data)
+        return self._sound(("square", freq, duration, duty),
+                           lambda: self.square_samples(freq, duration, duty))
     
     def make_triangle_wave(self, freq, duration):
         """NES triangle wave channel"""
         if not self.enabled:
             return None
-        samples = int(self.sample_rate * duration)
-        wave = []
-        period = self.sample_rate / freq
-        for i in range(samples):
-            phase = (i % period) / period
-            val = abs(4 * phase - 2) - 1
-            wave.append(int(val * 64))
-        
-        data = struct.pack('b' * len(wave), *wave)
-        return pygame.mixer.Sound(buffer=data)
+        return self._sound(("triangle", freq, duration, None),
+                           lambda: self.triangle_samples(freq, duration))
     
     def make_noise(self, duration, freq_div=16):
         """NES noise channel (LFSR)"""
         if not self.enabled:
             return None
-        samples = int(self.sample_rate * duration)
-        wave = []
-        lfsr = 1
-        counter = 0
-        for i in range(samples):
-            counter += 1
-            if counter >= freq_div:
-                counter = 0
-                bit0 = lfsr & 1
-                bit1 = (lfsr >> 1) & 1
-                lfsr >>= 1
-                if bit0 ^ bit1:
-                    lfsr |= 0x4000
-            wave.append(64 if lfsr & 1 else -64)
-        
-        data = struct.pack('b' * len(wave), *wave)
-        return pygame.mixer.Sound(buffer=data)
+        return self._sound(("noise", freq_div, duration, None),
+                           lambda: self.noise_samples(duration, freq_div))
 
     def play_bootleg_music(self, world):
         """Generate Team Hummer style music"""
@@ -232,12 +606,12 @@ class BootlegAPU:
         # Bootleg music patterns (simplified)
         notes = [261.63, 293.66, 329.63, 349.23, 392.00, 440.00]
         
-        # Play a simple melody
-        for note in notes:
-            sound = self.make_square_wave(note, 0.2)
-            if sound:
-                sound.play()
-                pygame.time.wait(200)
+        # Play a simple melody - one Sound of all the notes, so the mixer
+        # plays it while the level runs instead of waiting out each note
+        sound = self._sound(("music", tuple(notes), 0.2, None), lambda: b''.join(
+            [self.square_samples(note, 0.2) for note in notes]))
+        if sound:
+            sound.play()
 
 APU = BootlegAPU()
 
@@ -245,62 +619,231 @@ APU = BootlegAPU()
 # Sprite Rendering (OAM simulation)
 # ---------------------------------------------
 class SpriteOAM:
-    """Object Attribute Memory for sprites"""
+    """Object Attribute Memory - the frame's sprites, drawn in one batch
     
-    def __init__(self):
-        self.sprites = []  # Max 64 sprites on NES
-        
-    def add_sprite(self, x, y, tile, palette, flip_h=False, flip_v=False):
-        if len(self.sprites) < 64:
-            self.sprites.append({
-                'x': x, 'y': y, 'tile': tile,
-                'palette': palette, 'flip_h': flip_h, 'flip_v': flip_v
-            })
+    Entities submit sprites into pre-allocated slots while drawing; render()
+    blits them back to front with a single Surface.blits call. As on the
+    NES, the lower slot wins: earlier submissions draw on top, and
+    submissions past the last slot are dropped, which caps sprite cost per
+    frame like the NES's 64 entries. Submit what must stay visible first.
+    """
+    SLOTS = 64  # Max 64 sprites on NES
+    PER_SCANLINE = 8  # NES can only show 8 sprites per scanline
+    CLAIM = bytes(range(1, 256)) + b'\xff'  # Per-line count + 1
+    
+    def __init__(self, slots=SLOTS):
+        # One [surface, [x, y]] per slot, reused every frame
+        self.batch = [[None, [0, 0]] for _ in range(slots)]
+        self.count = 0
+        self.dropped = 0  # Submissions past the last slot this frame
+        self.flips = {}  # (surface, flip_h, flip_v) -> flipped copy
+        self.scanline_limit = False
+        self.rotation = 0  # Priority start, rotates each frame under the limit
+        self.lines = bytearray(NES_HEIGHT)
+    
+    def flipped(self, tile, flip_h, flip_v):
+        """Cached flipped variant of a sprite surface"""
+        key = (tile, flip_h, flip_v)
+        surf = self.flips.get(key)
+        if surf is None:
+            surf = self.flips[key] = pygame.transform.flip(tile, flip_h, flip_v)
+            if PERF.enabled:
+                PERF.surfaces += 1
+        return surf
+    
+    def add_sprite(self, x, y, tile, palette=None, flip_h=False, flip_v=False):
+        if self.count == len(self.batch):
+            self.dropped += 1
+            return
+        if flip_h or flip_v:
+            tile = self.flipped(tile, flip_h, flip_v)
+        entry = self.batch[self.count]
+        entry[0] = tile
+        pos = entry[1]
+        pos[0] = x
+        pos[1] = y
+        self.count += 1
     
     def clear(self):
-        self.sprites = []
+        self.count = 0
+        self.dropped = 0
     
     def render(self, surface):
-        # NES can only show 8 sprites per scanline (we'll simplify)
-        for sprite in self.sprites[:64]:
-            tile_surf = sprite['tile']
-            if sprite['flip_h']:
-                tile_surf = pygame.transform.flip(tile_surf, True, False)
-            if sprite['flip_v']:
-                tile_surf = pygame.transform.flip(tile_surf, False, True)
-            surface.blit(tile_surf, (sprite['x'], sprite['y']))
+        """Draw the submitted sprites (slot 0 last, on top), then start a new frame"""
+        if self.count:
+            batch = self.limit_scanlines() if self.scanline_limit else self.batch[self.count - 1::-1]
+            surface.blits(batch, False)
+            if PERF.enabled:
+                PERF.blits += len(batch)
+        self.clear()
+    
+    def limit_scanlines(self):
+        """Batch with rows past PER_SCANLINE sprites on a line dropped
+        
+        Slots claim scanlines in priority order; the first slot rotates
+        every frame, so overloaded lines flicker instead of losing the
+        same sprite for good.
+        """
+        n = self.count
+        lines = self.lines
+        lines[:] = bytes(NES_HEIGHT)
+        start = self.rotation % n
+        self.rotation += 1
+        spans = [None] * n
+        for i in list(range(start, n)) + list(range(start)):
+            tile, (x, y) = self.batch[i]
+            top, bottom = max(y, 0), min(y + tile.get_height(), NES_HEIGHT)
+            if top >= bottom:
+                spans[i] = ()
+                continue
+            if max(lines[top:bottom]) < self.PER_SCANLINE:
+                # Room on every line - claim them in one pass
+                lines[top:bottom] = lines[top:bottom].translate(self.CLAIM)
+                spans[i] = ((top, bottom),)
+                continue
+            runs = []
+            run = None
+            for row in range(top, bottom):
+                if lines[row] < self.PER_SCANLINE:
+                    lines[row] += 1
+                    if run is None:
+                        run = row
+                elif run is not None:
+                    runs.append((run, row))
+                    run = None
+            if run is not None:
+                runs.append((run, bottom))
+            spans[i] = runs
+        batch = []
+        for i in range(n - 1, -1, -1):
+            tile, (x, y) = self.batch[i]
+            runs = spans[i]
+            width = tile.get_width()
+            for top, bottom in runs:
+                batch.append((tile, (x, top), (0, top - y, width, bottom - top)))
+        return batch
+
+class SpriteBank:
+    """Shared sprite assets - pixels built once per kind as palette indices
+    
+    Each (kind, color_type) is a copy of the kind's 8-bit sprite with its
+    own palette (a palette write, not a redraw), pre-flipped. Index 0 is
+    transparent.
+    """
+    COLORKEY = (255, 0, 255)  # Palette entry 0, never drawn
+    
+    def __init__(self):
+        self.builders = {}  # kind -> (build_sprite(), sprite_palette(color_type))
+        self.pixels = {}  # kind -> 8-bit index sprite
+        self.sprites = {}  # (kind, color_type) -> (normal, flipped)
+    
+    def register(self, kind, builder, palette):
+        self.builders[kind] = (builder, palette)
+    
+    def get(self, kind, color_type=0):
+        key = (kind, color_type)
+        pair = self.sprites.get(key)
+        if pair is None:
+            builder, palette = self.builders[kind]
+            pixels = self.pixels.get(kind)
+            if pixels is None:
+                pixels = self.pixels[kind] = builder()
+            sprite = pixels.copy()
+            self.recolor(sprite, palette(color_type))
+            pair = (sprite, pygame.transform.flip(sprite, True, False))
+            self.sprites[key] = pair
+            if PERF.enabled:
+                PERF.surfaces += 2
+        return pair
+    
+    def recolor(self, sprite, colors):
+        """Set an index sprite's colors (entry 0 stays transparent)"""
+        sprite.set_palette([self.COLORKEY] + list(colors))
+        sprite.set_colorkey(0)
+    
+    @staticmethod
+    def index_sprite(pattern, index):
+        """8-bit sprite from a character pattern and an index(x, y, char) rule"""
+        sprite = pygame.Surface((len(pattern[0]), len(pattern)), 0, 8)
+        sprite.fill(0)
+        painted = 0
+        for y, row in enumerate(pattern):
+            for x, char in enumerate(row):
+                value = index(x, y, char)
+                if value:
+                    sprite.set_at((x, y), value)
+                    painted += 1
+        if PERF.enabled:
+            PERF.set_at += painted
+        return sprite
 
 OAM = SpriteOAM()
+TILE_ATLAS = TileAtlas()
+FONT = GlyphAtlas()
+SPRITES = SpriteBank()
 
 # ---------------------------------------------
 # Koopa Entity (NES Style)
 # ---------------------------------------------
+def _pool_field(name, cast):
+    """KoopaNES attribute stored in its EnemyPool arrays"""
+    def get(self):
+        return cast(getattr(self.pool, name)[self.index])
+    def set(self, value):
+        getattr(self.pool, name)[self.index] = value
+    return property(get, set)
+
 class KoopaNES:
-    def __init__(self, x, y, color_type=0):
-        self.x = x
-        self.y = y
-        self.vx = -0.5  # Slow like NES
-        self.vy = 0
+    """Koopa view onto one EnemyPool slot"""
+    KIND = "koopa"
+    
+    x = _pool_field('x', float)
+    y = _pool_field('y', float)
+    vx = _pool_field('vx', float)
+    vy = _pool_field('vy', float)
+    alive = _pool_field('alive', bool)
+    in_shell = _pool_field('in_shell', bool)
+    frame = _pool_field('frame', int)
+    
+    def __init__(self, x, y, color_type=0, pool=None):
         self.width = 16
         self.height = 16
         self.color_type = color_type
-        self.frame = 0
-        self.alive = True
-        self.in_shell = False
         
-        # Generate sprite
+        # Standalone koopas get a pool of their own
+        self.pool = None
+        self.index = -1
+        (pool if pool is not None else EnemyPool(1)).add(self, x, y)
+        
+        # Shared sprite
         self.generate_sprite()
     
+    @classmethod
+    def in_slot(cls, pool, color_type):
+        """View bound to the pool's next slot, whose fields are already set"""
+        koopa = cls.__new__(cls)
+        koopa.width = 16
+        koopa.height = 16
+        koopa.color_type = color_type
+        pool.bind(koopa)
+        koopa.generate_sprite()
+        return koopa
+    
     def generate_sprite(self):
-        """Generate procedural Koopa sprite"""
-        # Use palette based on type
-        pal = WORLD_PALETTES[self.color_type % len(WORLD_PALETTES)]
+        """Look up the shared (normal, flipped) sprite pair"""
+        color_type = self.color_type % len(WORLD_PALETTES)
+        self.sprite, self.sprite_flipped = SPRITES.get(self.KIND, color_type)
+    
+    @staticmethod
+    def sprite_palette(color_type):
+        """Shell light/dark and eye colors for a world's sprite palette"""
+        pal = WORLD_PALETTES[color_type % len(WORLD_PALETTES)]
         colors = [NES_PALETTE[pal['sprite'][i] if i < len(pal['sprite']) else 0x0F] for i in range(4)]
-        
-        # Build detailed koopa sprite
-        self.sprite = pygame.Surface((16, 16), pygame.SRCALPHA)
-        self.sprite.fill((0,0,0,0))
-        
+        return [colors[1], colors[2], (0, 0, 0)]
+    
+    @staticmethod
+    def build_sprite():
+        """Generate procedural Koopa sprite as palette indices"""
         # Koopa sprite pattern (16x16)
         koopa_pattern = [
             #0123456789ABCDEF
@@ -322,18 +865,12 @@ class KoopaNES:
             "   ###  ###     ",  # F
         ]
         
-        # Color mapping
-        for y in range(16):
-            for x in range(16):
-                if x < len(koopa_pattern[y]):
-                    char = koopa_pattern[y][x]
-                    if char == '#':  # Shell
-                        color_idx = (x + y) % 2
-                        self.sprite.set_at((x, y), colors[1 + color_idx])
-                    elif char == '@':  # Eyes
-                        self.sprite.set_at((x, y), (0, 0, 0))
-                    elif char == ' ':  # Transparent
-                        pass
+        # Shell checkers between indices 1 and 2, eyes are 3
+        def index(x, y, char):
+            if char == '#':
+                return 1 + (x + y) % 2
+            return 3 if char == '@' else 0
+        return SpriteBank.index_sprite(koopa_pattern, index)
     
     def update(self, level):
         # Simple NES-style physics
@@ -343,31 +880,340 @@ class KoopaNES:
             self.vy = 4
         self.y += self.vy
         
-        # Collision with ground (simplified)
-        ground_y = 200
-        if self.y + self.height > ground_y:
-            self.y = ground_y - self.height
+        # Land on the tile floor under either foot
+        start = int((self.y + self.height - 1 - STEP_HEIGHT) // TILE_SIZE)
+        floor = min(level.floor_row(int((self.x + 4) // TILE_SIZE), start),
+                    level.floor_row(int((self.x + 11) // TILE_SIZE), start))
+        on_ground = self.y + self.height > floor * TILE_SIZE
+        if on_ground:
+            self.y = floor * TILE_SIZE - self.height
             self.vy = 0
         
-        # Turn at edges
-        if self.x < 0 or self.x > NES_WIDTH - self.width:
+        # Turn at walls, ledges and level edges
+        ahead = self.x + self.width if self.vx > 0 else self.x - 1
+        tx = int(ahead // TILE_SIZE)
+        top = int(self.y // TILE_SIZE)
+        upper = int((self.y + self.height - 1 - STEP_HEIGHT) // TILE_SIZE)
+        turn = level.solid_tile(tx, top) or level.solid_tile(tx, upper)
+        if on_ground:
+            feet = int((self.y + self.height) // TILE_SIZE)
+            turn = turn or level.floor_row(tx, feet) - feet >= LEDGE_DROP
+        if turn or self.x < 0 or self.x > level.width * TILE_SIZE - self.width:
             self.vx = -self.vx
         
         self.frame += 1
     
-    def draw(self, surface, cam_x):
+    def draw(self, oam, cam_x):
+        """Submit the sprite to OAM"""
         if self.alive:
             x = int(self.x - cam_x)
             if -16 <= x <= NES_WIDTH:
                 # Animate with simple flip
                 flip = (self.frame // 8) % 2 == 0
-                sprite = pygame.transform.flip(self.sprite, flip, False) if flip else self.sprite
-                surface.blit(sprite, (x, int(self.y)))
+                sprite = self.sprite_flipped if flip else self.sprite
+                oam.add_sprite(x, int(self.y), sprite)
+
+# ---------------------------------------------
+# Enemy Pool (structure of arrays)
+# ---------------------------------------------
+class SpatialHash:
+    """Uniform grid broadphase on tile-sized cells, rebuilt each frame
+    
+    Each entity is bucketed by the cell of its x/y, so a query only has to
+    scan the cells within reach. With numpy the grid is a sorted key array
+    searched per column; without it, a dict of cell lists.
+    """
+    
+    CELL = TILE_SIZE
+    ROWS = 64  # Cell rows, y is clamped into range
+    
+    def __init__(self):
+        self.keys = None
+        self.items = None
+        self.cells = {}
+    
+    def _row(self, y):
+        return min(max(int(y // self.CELL), 0), self.ROWS - 1)
+    
+    def rebuild(self, xs, ys, indices):
+        """Bucket the entities at the given slot indices"""
+        if numpy is not None:
+            cx = numpy.floor_divide(xs[indices], self.CELL).astype(numpy.int64)
+            cy = numpy.clip(numpy.floor_divide(ys[indices], self.CELL), 0, self.ROWS - 1)
+            keys = cx * self.ROWS + cy.astype(numpy.int64)
+            order = numpy.argsort(keys)
+            self.keys = keys[order]
+            self.items = numpy.asarray(indices)[order]
+            return
+        self.cells = {}
+        for i in indices:
+            key = (int(xs[i] // self.CELL), self._row(ys[i]))
+            self.cells.setdefault(key, []).append(i)
+    
+    def query(self, x, y, reach):
+        """Slot indices bucketed within reach of (x, y), in slot order"""
+        cx0 = int((x - reach) // self.CELL)
+        cx1 = int((x + reach) // self.CELL)
+        cy0, cy1 = self._row(y - reach), self._row(y + reach)
+        if numpy is not None:
+            columns = numpy.arange(cx0, cx1 + 1, dtype=numpy.int64) * self.ROWS
+            lo = numpy.searchsorted(self.keys, columns + cy0, 'left')
+            hi = numpy.searchsorted(self.keys, columns + cy1, 'right')
+            found = [self.items[a:b] for a, b in zip(lo, hi) if b > a]
+            if not found:
+                return []
+            return sorted(numpy.concatenate(found).tolist())
+        found = []
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                found.extend(self.cells.get((cx, cy), ()))
+        return sorted(found)
+
+class EnemyPool:
+    """Koopa state in contiguous arrays, stepped as one batch per frame
+    
+    Iterating, indexing and append() work like the old list of KoopaNES;
+    each KoopaNES is a view onto its slot.
+    """
+    
+    SIZE = 16  # Koopas are 16x16
+    FIELDS = (('x', 'd'), ('y', 'd'), ('vx', 'd'), ('vy', 'd'),
+              ('alive', 'B'), ('in_shell', 'B'), ('frame', 'q'))
+    PACKED_SLOT = sum(array(typecode).itemsize for _, typecode in FIELDS) + 1  # pack() bytes per koopa
+    
+    REACH = 14  # Overlap distance between 16x16 sprites
+    
+    def __init__(self, capacity=64):
+        self.count = 0
+        self.views = []  # KoopaNES per slot
+        self.grid = SpatialHash()
+        self.capacity = 0
+        for name, _ in self.FIELDS:
+            setattr(self, name, None)
+        self._grow(max(1, capacity))
+    
+    def _grow(self, capacity):
+        for name, typecode in self.FIELDS:
+            old = getattr(self, name)
+            if numpy is not None:
+                dtype = bool if typecode == 'B' else typecode
+                new = numpy.zeros(capacity, dtype=dtype)
+                if old is not None:
+                    new[:self.count] = old[:self.count]
+            else:
+                new = array(typecode, bytes(array(typecode).itemsize * capacity))
+                if old is not None:
+                    new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+        self.capacity = capacity
+    
+    def add(self, koopa, x, y, vx=-0.5, vy=0, alive=True, in_shell=False, frame=0):
+        """Bind a KoopaNES view to a new slot"""
+        self.bind(koopa)
+        koopa.x, koopa.y, koopa.vx, koopa.vy = x, y, vx, vy  # Slow like NES
+        koopa.alive, koopa.in_shell, koopa.frame = alive, in_shell, frame
+        return koopa
+    
+    def bind(self, koopa):
+        """Point a view at the next slot, leaving the slot's fields as they are"""
+        if self.count == self.capacity:
+            self._grow(self.capacity * 2)
+        koopa.pool = self
+        koopa.index = self.count
+        self.count += 1
+        self.views.append(koopa)
+        return koopa
+    
+    def spawn(self, x, y, color_type=0):
+        return KoopaNES(x, y, color_type, pool=self)
+    
+    def append(self, koopa):
+        """Move a koopa (and its state) into this pool"""
+        if koopa.pool is not self:
+            self.add(koopa, koopa.x, koopa.y, koopa.vx, koopa.vy,
+                     koopa.alive, koopa.in_shell, koopa.frame)
+    
+    def despawn(self, left, right):
+        """Free the slots of dead koopas and those outside [left, right)
+        
+        The rest are compacted in slot order.
+        """
+        n = self.count
+        if numpy is not None:
+            x = self.x[:n]
+            keep = numpy.flatnonzero(self.alive[:n] & (x >= left) & (x < right)).tolist()
+        else:
+            x = self.x
+            keep = [i for i in range(n) if self.alive[i] and left <= x[i] < right]
+        if len(keep) == n:
+            return
+        kept = set(keep)
+        for i in range(n):
+            if i not in kept:
+                # Detach with its state, so stale references never alias a live slot
+                EnemyPool(1).append(self.views[i])
+        for name, typecode in self.FIELDS:
+            values = getattr(self, name)
+            if numpy is not None:
+                values[:len(keep)] = values[keep]
+            else:
+                values[:len(keep)] = array(typecode, [values[i] for i in keep])
+        self.views = [self.views[i] for i in keep]
+        self.count = len(keep)
+        for i, koopa in enumerate(self.views):
+            koopa.index = i
+        self.grid.rebuild(self.x, self.y, range(self.count) if numpy is None
+                          else numpy.arange(self.count))
+    
+    def pack(self):
+        """Slot state column by column, then color types (for save states)"""
+        n = self.count
+        parts = []
+        for name, typecode in self.FIELDS:
+            values = getattr(self, name)[:n]
+            if numpy is not None:
+                parts.append(values.astype('<' + typecode).tobytes())
+            else:
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                parts.append(values.tobytes())
+        parts.append(bytes(koopa.color_type for koopa in self.views))
+        return b''.join(parts)
+    
+    @classmethod
+    def unpack(cls, data, offset, count):
+        """New pool from pack() output at offset"""
+        pool = cls(max(count, 64))
+        end = offset + count * cls.PACKED_SLOT
+        for name, typecode in cls.FIELDS:
+            values = getattr(pool, name)
+            size = count * array(typecode).itemsize
+            if numpy is not None:
+                values[:count] = numpy.frombuffer(data, '<' + typecode, count, offset)
+            else:
+                column = array(typecode, bytes(data[offset:offset + size]))
+                if sys.byteorder == 'big':
+                    column.byteswap()
+                values[:count] = column
+            offset += size
+        for color_type in data[end - count:end]:
+            KoopaNES.in_slot(pool, color_type)
+        return pool
+    
+    def __len__(self):
+        return self.count
+    
+    def __iter__(self):
+        return iter(self.views)
+    
+    def __getitem__(self, i):
+        return self.views[i]
+    
+    def step(self, level):
+        """KoopaNES.update for every koopa at once
+        
+        Returns the number of koopas knocked out by moving shells.
+        """
+        n = self.count
+        if numpy is None:
+            for koopa in self.views:
+                koopa.update(level)
+            self.grid.rebuild(self.x, self.y, [i for i in range(n) if self.alive[i]])
+            return self.kick_shells()
+        x, y, vx, vy = self.x[:n], self.y[:n], self.vx[:n], self.vy[:n]
+        x += vx
+        vy += 0.2  # Gravity
+        numpy.minimum(vy, 4, out=vy)
+        y += vy
+        
+        # Land on the tile floor under either foot
+        # Collision tables cover the resident columns [origin, origin + columns)
+        origin, columns, height = level.origin, level.columns, level.height
+        floor_index = numpy.frombuffer(level.floor_index, numpy.uint8).reshape(columns, height + 1)
+        solid = numpy.frombuffer(level.solid, numpy.uint8).reshape(height, columns)
+        
+        def tiles(values, low, limit):
+            return numpy.clip(numpy.floor_divide(values, TILE_SIZE).astype(numpy.int64) - low, 0, limit)
+        
+        start = tiles(y + self.SIZE - 1 - STEP_HEIGHT, 0, height)
+        floor = numpy.minimum(floor_index[tiles(x + 4, origin, columns - 1), start],
+                              floor_index[tiles(x + 11, origin, columns - 1), start])
+        landed = y + self.SIZE > floor * TILE_SIZE
+        y[landed] = floor[landed] * TILE_SIZE - self.SIZE
+        vy[landed] = 0
+        
+        # Turn at walls, ledges and level edges
+        ahead = numpy.where(vx > 0, x + self.SIZE, x - 1)
+        tx = numpy.floor_divide(ahead, TILE_SIZE).astype(numpy.int64) - origin
+        col = numpy.clip(tx, 0, columns - 1)
+        turn = (tx < 0) | (tx >= columns)
+        for row in (numpy.floor_divide(y, TILE_SIZE).astype(numpy.int64),
+                    numpy.floor_divide(y + self.SIZE - 1 - STEP_HEIGHT, TILE_SIZE).astype(numpy.int64)):
+            inside = (row >= 0) & (row < height)
+            turn |= inside & (solid[numpy.clip(row, 0, height - 1), col] != 0)
+        feet = numpy.floor_divide(y + self.SIZE, TILE_SIZE).astype(numpy.int64)
+        drop = floor_index[col, numpy.clip(feet, 0, height)].astype(numpy.int64) - feet
+        turn |= landed & (drop >= LEDGE_DROP)
+        turn |= (x < 0) | (x > level.width * TILE_SIZE - self.SIZE)
+        vx[turn] = -vx[turn]
+        
+        self.frame[:n] += 1
+        
+        self.grid.rebuild(self.x, self.y, numpy.flatnonzero(self.alive[:n]))
+        return self.kick_shells()
+    
+    def nearby(self, px, py, reach=REACH):
+        """Slot indices of live koopas overlapping a point (narrow phase)"""
+        x, y = self.x, self.y
+        return [i for i in self.grid.query(px, py, reach)
+                if abs(px - x[i]) < reach and abs(py - y[i]) < reach]
+    
+    def touching(self, px, py, reach=REACH):
+        """Live koopas overlapping a point, in slot order"""
+        return [self.views[i] for i in self.nearby(px, py, reach)]
+    
+    def kick_shells(self):
+        """Moving shells knock out the koopas they run into"""
+        knocked = 0
+        if numpy is not None:
+            n = self.count
+            shells = numpy.flatnonzero(self.alive[:n] & self.in_shell[:n] & (self.vx[:n] != 0))
+        else:
+            shells = [i for i in range(self.count)
+                      if self.alive[i] and self.in_shell[i] and self.vx[i] != 0]
+        for s in shells:
+            if not self.alive[s]:
+                continue
+            for i in self.nearby(self.x[s], self.y[s]):
+                if i != s and self.alive[i] and not self.in_shell[i]:
+                    self.alive[i] = False
+                    knocked += 1
+        return knocked
+    
+    def draw(self, oam, cam_x):
+        """KoopaNES.draw for every koopa, culling off-screen ones in bulk"""
+        n = self.count
+        if numpy is None:
+            for koopa in self.views:
+                koopa.draw(oam, cam_x)
+            return
+        sx = (self.x[:n] - cam_x).astype(int)
+        visible = self.alive[:n] & (sx >= -16) & (sx <= NES_WIDTH)
+        sy = self.y[:n].astype(int)
+        # Animate with simple flip
+        flip = (self.frame[:n] // 8) % 2 == 0
+        views = self.views
+        for i in numpy.flatnonzero(visible):
+            koopa = views[i]
+            sprite = koopa.sprite_flipped if flip[i] else koopa.sprite
+            oam.add_sprite(int(sx[i]), int(sy[i]), sprite)
 
 # ---------------------------------------------
 # Player (Koopa Mario)
 # ---------------------------------------------
 class KoopaPlayer:
+    KIND = "player"
+    
     def __init__(self):
         self.x = 32
         self.y = 100
@@ -387,20 +1233,24 @@ class KoopaPlayer:
         self.generate_sprite()
     
     def generate_sprite(self):
-        """Generate player Koopa sprite"""
-        # Classic Mario colors in NES palette
-        colors = {
-            'red': NES_PALETTE[0x16],     # Mario's red
-            'blue': NES_PALETTE[0x11],    # Mario's blue overalls
-            'skin': NES_PALETTE[0x27],    # Skin tone
-            'brown': NES_PALETTE[0x07],   # Brown for shoes
-            'white': NES_PALETTE[0x30],   # White
-            'green': NES_PALETTE[0x1A],   # Koopa green
-        }
-        
-        self.sprite = pygame.Surface((16, 16), pygame.SRCALPHA)
-        self.sprite.fill((0,0,0,0))
-        
+        """Look up the shared (normal, flipped) sprite pair"""
+        self.sprite, self.sprite_flipped = SPRITES.get(self.KIND)
+    
+    @staticmethod
+    def sprite_palette(color_type=0):
+        """Classic Mario colors in NES palette, by sprite index"""
+        return [
+            NES_PALETTE[0x1A],  # 1 - Koopa green
+            NES_PALETTE[0x27],  # 2 - Skin tone
+            (0, 0, 0),          # 3 - Eyes
+            NES_PALETTE[0x16],  # 4 - Mario's red
+            NES_PALETTE[0x11],  # 5 - Mario's blue overalls
+            NES_PALETTE[0x07],  # 6 - Brown for shoes
+        ]
+    
+    @staticmethod
+    def build_sprite():
+        """Generate player Koopa sprite as palette indices"""
         # Koopa Mario sprite pattern
         mario_pattern = [
             #0123456789ABCDEF
@@ -422,26 +1272,11 @@ class KoopaPlayer:
             "  BBBB  BBBB    ",  # F - shoes
         ]
         
-        # Color mapping
-        for y in range(16):
-            for x in range(16):
-                if x < len(mario_pattern[y]):
-                    char = mario_pattern[y][x]
-                    if char == '#':  # Koopa shell (green)
-                        self.sprite.set_at((x, y), colors['green'])
-                    elif char == 'S':  # Skin
-                        self.sprite.set_at((x, y), colors['skin'])
-                    elif char == '@':  # Eyes (black)
-                        self.sprite.set_at((x, y), (0, 0, 0))
-                    elif char == 'R':  # Red shirt
-                        self.sprite.set_at((x, y), colors['red'])
-                    elif char == 'B':  # Blue overalls/shoes
-                        if y >= 15:  # Shoes row
-                            self.sprite.set_at((x, y), colors['brown'])
-                        else:
-                            self.sprite.set_at((x, y), colors['blue'])
-                    elif char == ' ':  # Transparent
-                        pass
+        # Color mapping; the last 'B' row is shoes, not overalls
+        indices = {'#': 1, 'S': 2, '@': 3, 'R': 4, 'B': 5}
+        def index(x, y, char):
+            return 6 if char == 'B' and y >= 15 else indices.get(char, 0)
+        return SpriteBank.index_sprite(mario_pattern, index)
     
     def update(self, keys, level):
         # NES-style controls
@@ -471,23 +1306,16 @@ class KoopaPlayer:
         
         # Apply physics
         self.x += self.vx
+        self.collide_walls(level)
         self.vy += 0.25  # Gravity
         if self.vy > 5:
             self.vy = 5
         self.y += self.vy
+        self.collide_floor(level)
         
-        # Ground collision (simplified)
-        ground_y = 200
-        if self.y + self.height > ground_y:
-            self.y = ground_y - self.height
-            self.vy = 0
-            self.on_ground = True
-        else:
-            self.on_ground = False
-        
-        # Screen bounds
-        if self.x < 0:
-            self.x = 0
+        # Screen bounds (streamed levels forget what is behind origin)
+        if self.x < level.origin * TILE_SIZE:
+            self.x = level.origin * TILE_SIZE
         if self.x > level.width * TILE_SIZE - self.width:
             self.x = level.width * TILE_SIZE - self.width
         
@@ -495,93 +1323,415 @@ class KoopaPlayer:
         if self.invincible > 0:
             self.invincible -= 1
     
-    def draw(self, surface, cam_x):
+    def collide_walls(self, level):
+        """Push out of solid tiles beside the body (feet climb steps)"""
+        if self.vx == 0:
+            return
+        edge = self.x + self.width - 1 if self.vx > 0 else self.x
+        tx = int(edge // TILE_SIZE)
+        top = int(self.y // TILE_SIZE)
+        upper = int((self.y + self.height - 1 - STEP_HEIGHT) // TILE_SIZE)
+        for ty in range(top, upper + 1):
+            if level.solid_tile(tx, ty):
+                self.x = tx * TILE_SIZE - self.width if self.vx > 0 else (tx + 1) * TILE_SIZE
+                self.vx = 0
+                return
+    
+    def collide_floor(self, level):
+        """Land on the floor index, or bump the head on solid tiles"""
+        self.on_ground = False
+        left = int(self.x // TILE_SIZE)
+        right = int((self.x + self.width - 1) // TILE_SIZE)
+        if self.vy >= 0:
+            start = int((self.y + self.height - 1 - STEP_HEIGHT) // TILE_SIZE)
+            floor = min(level.floor_row(tx, start) for tx in range(left, right + 1))
+            if self.y + self.height > floor * TILE_SIZE:
+                self.y = floor * TILE_SIZE - self.height
+                self.vy = 0
+                self.on_ground = True
+        else:
+            head = int(self.y // TILE_SIZE)
+            if any(level.solid_tile(tx, head) for tx in range(left, right + 1)):
+                self.y = (head + 1) * TILE_SIZE
+                self.vy = 0
+    
+    def draw(self, oam, cam_x):
+        """Submit the sprite to OAM"""
         # Flicker when invincible
         if self.invincible > 0 and self.invincible % 4 < 2:
             return
         
         x = int(self.x - cam_x)
         if -16 <= x <= NES_WIDTH:
-            sprite = pygame.transform.flip(self.sprite, not self.facing_right, False)
-            surface.blit(sprite, (x, int(self.y)))
+            sprite = self.sprite if self.facing_right else self.sprite_flipped
+            oam.add_sprite(x, int(self.y), sprite)
+
+SPRITES.register(KoopaNES.KIND, KoopaNES.build_sprite, KoopaNES.sprite_palette)
+SPRITES.register(KoopaPlayer.KIND, KoopaPlayer.build_sprite, KoopaPlayer.sprite_palette)
 
 # ---------------------------------------------
 # Level (Procedural NES Style)
 # ---------------------------------------------
+class Nametable:
+    """Scrolling nametable - pre-composited tile strip streamed in 8px columns
+    
+    The strip holds CHR bank palette indices and shares the bank palette,
+    so recolors and palette cycles never redraw a cell.
+    """
+    
+    COLORKEY = TileAtlas.COLORKEY  # Bank entry marking empty cells
+    
+    def __init__(self, level, columns=NES_WIDTH // TILE_SIZE + 2):
+        self.level = level
+        self.columns = columns
+        self.surface = pygame.Surface((columns * TILE_SIZE,
+                                       level.height * TILE_SIZE), 0, 8)
+        self.surface.set_colorkey(self.COLORKEY)
+        self.slot_column = [-1] * columns  # Level column held by each slot
+        self.dirty = set()
+        self.version = None  # Bank palette version last copied
+        self.epoch = TILE_ATLAS.epoch  # Bank entry releases seen
+    
+    def invalidate(self):
+        """Drop every streamed column"""
+        self.slot_column = [-1] * self.columns
+        self.dirty.clear()
+    
+    def mark_dirty(self, tx, ty):
+        """Redraw a single cell if its column is streamed in"""
+        if self.slot_column[tx % self.columns] == tx:
+            self.dirty.add((tx, ty))
+    
+    def _draw_cell(self, tx, ty, rects):
+        pos = ((tx % self.columns) * TILE_SIZE, ty * TILE_SIZE)
+        tile = self.level.tile(tx, ty)
+        if tile > 0:
+            self.surface.blit(TILE_ATLAS.surface, pos, rects[tile])
+            if PERF.enabled:
+                PERF.blits += 1
+        else:
+            self.surface.fill(self.COLORKEY, (pos, (TILE_SIZE, TILE_SIZE)))
+    
+    def _draw_column(self, tx, rects):
+        slot = tx % self.columns
+        self.surface.fill(self.COLORKEY, (slot * TILE_SIZE, 0,
+                                          TILE_SIZE, self.surface.get_height()))
+        self.slot_column[slot] = tx
+        if tx >= self.level.width:
+            return  # Past the level end stays empty
+        atlas = TILE_ATLAS.surface
+        x = slot * TILE_SIZE
+        column = self.level.column(tx)
+        for ty, tile in enumerate(column):
+            if tile > 0:
+                self.surface.blit(atlas, (x, ty * TILE_SIZE), rects[tile])
+        if PERF.enabled:
+            PERF.blits += len(column) - column.count(0)
+    
+    def draw(self, surface, cam_x, rects=None):
+        """Stream in new columns, then present the strip in one or two blits"""
+        if rects is None:
+            rects = self.level.tile_rects()
+        if self.epoch != TILE_ATLAS.epoch:
+            # Released bank entries may be reused - redraw every column
+            self.epoch = TILE_ATLAS.epoch
+            self.invalidate()
+        if self.version != TILE_ATLAS.version:
+            # Pick up recolors and cycles; the strip's indices stay valid
+            self.version = TILE_ATLAS.version
+            self.surface.set_palette(TILE_ATLAS.colors)
+        
+        first = max(0, cam_x // TILE_SIZE)
+        for tx in range(first, first + self.columns):
+            if self.slot_column[tx % self.columns] != tx:
+                self._draw_column(tx, rects)
+        
+        for tx, ty in self.dirty:
+            if self.slot_column[tx % self.columns] == tx:
+                self._draw_cell(tx, ty, rects)
+        self.dirty.clear()
+        
+        # Wrap-around present
+        strip_w = self.surface.get_width()
+        src_x = cam_x % strip_w
+        height = self.surface.get_height()
+        first_w = min(strip_w - src_x, NES_WIDTH)
+        surface.blit(self.surface, (0, 0), (src_x, 0, first_w, height))
+        if first_w < NES_WIDTH:
+            surface.blit(self.surface, (first_w, 0), (0, 0, NES_WIDTH - first_w, height))
+        if PERF.enabled:
+            PERF.blits += 1 if first_w == NES_WIDTH else 2
+
+def ground_heights(first, count):
+    """Ground height (top solid row) for columns [first, first + count)"""
+    ground_height = 25
+    if numpy is not None:
+        wave = (numpy.sin(numpy.arange(first, first + count) * 0.1) * 2).astype(numpy.int64)
+        return (ground_height + wave).tolist()
+    return [ground_height + int(math.sin(x * 0.1) * 2) for x in range(first, first + count)]
+
+def generate_tiles(first, width, height, roll, lookbehind=0, lookahead=0):
+    """Row-major tiles for level columns [first, first + width)
+    
+    roll(x, a, b) is the random draw for the feature column x. Features
+    are visited in column order (platform, pipe, then question block per
+    column); lookbehind includes earlier feature columns whose platforms
+    and pipes reach into the range, lookahead later pipes whose approach
+    does (their heights are rolled last).
+    
+    Every pipe stays passable: platforms and blocks hanging lower than
+    PIPE_HEADROOM over it, or over the PIPE_APPROACH columns before it,
+    are cleared so there is room to jump it from the ground.
+    """
+    end = first + width
+    start = first - lookbehind
+    heights = ground_heights(start, end + lookahead + 1 - start)
+    
+    # Fill whole rows at once: a row is solid wherever its height <= y
+    column_heights = bytes(heights[first - start:end - start])
+    tilemap = bytearray(width * height)
+    for y in range(height):
+        below = b'\x01' * (y + 1) + b'\x00' * (255 - y)
+        tilemap[y * width:(y + 1) * width] = column_heights.translate(below)
+    
+    features = [x for x in range(start, end)
+                if x % 20 == 10 or x % 35 == 20 or x % 15 == 7]
+    pipes = []  # (column, top row)
+    for x in features:
+        h = heights[x - start]
+        col = x - first
+        
+        # Random platforms
+        if x % 20 == 10:
+            platform_y = h - roll(x, 5, 10)
+            if platform_y > 10:
+                row = platform_y * width
+                left, right = max(col, 0), min(col + 5, width)
+                if left < right:
+                    tilemap[row + left:row + right] = b'\x01' * (right - left)
+        
+        # Pipes (Team Hummer loves pipes)
+        if x % 35 == 20:
+            pipe_height = roll(x, 3, 6)
+            top = max(0, h - pipe_height)
+            pipes.append((x, top))
+            if col >= 0:
+                tilemap[top * width + col:h * width + col:width] = b'\x02' * (h - top)
+            if 0 <= col + 1 < width:
+                # Ground of the next column wins where the pipe reaches into it
+                bottom = max(top, min(h, heights[x + 1 - start]))
+                tilemap[top * width + col + 1:bottom * width + col + 1:width] = b'\x02' * (bottom - top)
+        
+        # Question blocks
+        if x % 15 == 7 and col >= 0:
+            block_y = h - roll(x, 4, 8)
+            if block_y > 10:
+                tilemap[block_y * width + col] = 3  # Question block
+    
+    # Clear the way over each pipe (and those just past the range)
+    pipes += [(x, max(0, heights[x - start] - roll(x, 3, 6)))
+              for x in range(end, end + lookahead) if x % 35 == 20]
+    for x, top in pipes:
+        clear = max(0, top - PIPE_HEADROOM) * width - first
+        for col in range(max(x - PIPE_APPROACH, first), min(x + 2, end)):
+            cells = slice(clear + col, heights[col - start] * width + col - first, width)
+            tilemap[cells] = tilemap[cells].translate(KEEP_PIPES)
+    return tilemap
+
 class NESLevel:
-    def __init__(self, world, level_num):
+    # Pipes get special green palette, question blocks are yellow
+    PIPE_PALETTE = (0x0F, 0x1A, 0x2A, 0x3A)
+    QUESTION_PALETTE = (0x0F, 0x27, 0x37, 0x30)
+    
+    # Koopas wake up this far past the screen edges and despawn beyond it
+    ACTIVE_MARGIN = 2 * SPRITE_SIZE
+    
+    def __init__(self, world, level_num, width=256, tilemap=None, spawns=None, collision=None):
         self.world = world
         self.level_num = level_num
-        self.width = 256  # In tiles
+        self.width = width  # In tiles
         self.height = 30  # In tiles (NES nametable height)
-        self.tilemap = []
-        self.enemies = []
+        # Resident columns [origin, origin + columns) - all of them here,
+        # a sliding window in StreamingLevel
+        self.origin = 0
+        self.columns = width
+        self.tilemap = bytearray()  # Row-major, stride = columns
+        self.spawns = spawns  # (x, y, color_type) per koopa, sorted by x
+        self.spawn_cursor = 0  # First spawn that has not entered the window
+        self.enemies = EnemyPool()  # Awake koopas only
+        self.edits = {}  # (tx, ty) -> generated tile, for cells set_tile changed
         
-        # Generate tilemap
-        self.generate()
+        # Generate tilemap (or take a loaded one, and its collision tables, as is)
+        if tilemap is None:
+            self.generate()
+        else:
+            self.tilemap = tilemap
+            if collision is None:
+                self.build_collision()
+            else:
+                self.solid, self.floor_index, self.surface = collision
         
         # Spawn enemies
         self.spawn_enemies()
+        
+        # Warm the CHR bank
+        self.tile_rects()
+        
+        self.nametable = Nametable(self)
     
     def generate(self):
         """Generate Team Hummer style level"""
-        random.seed(self.world * 100 + self.level_num)
-        
-        # Initialize empty
-        self.tilemap = [[0 for _ in range(self.width)] for _ in range(self.height)]
-        
-        # Ground
-        ground_height = 25
-        for x in range(self.width):
-            # Vary height
-            h = ground_height + int(math.sin(x * 0.1) * 2)
-            for y in range(h, self.height):
-                self.tilemap[y][x] = 1  # Solid tile
-            
-            # Random platforms
-            if x % 20 == 10:
-                platform_y = h - random.randint(5, 10)
-                if platform_y > 10:
-                    for dx in range(5):
-                        if x + dx < self.width:
-                            self.tilemap[platform_y][x + dx] = 1
-            
-            # Pipes (Team Hummer loves pipes)
-            if x % 35 == 20:
-                pipe_height = random.randint(3, 6)
-                for dy in range(pipe_height):
-                    y = h - 1 - dy
-                    if y >= 0:
-                        self.tilemap[y][x] = 2  # Pipe tile
-                        if x + 1 < self.width:
-                            self.tilemap[y][x + 1] = 2
-            
-            # Question blocks
-            if x % 15 == 7:
-                block_y = h - random.randint(4, 8)
-                if block_y > 10:
-                    self.tilemap[block_y][x] = 3  # Question block
+        rng = random.Random(self.world * 100 + self.level_num)
+        self.tilemap = generate_tiles(0, self.width, self.height,
+                                      lambda x, a, b: rng.randint(a, b))
+        self.build_collision()
+    
+    def stream(self, cam_x):
+        """Keep the columns around the camera resident (all of them here)"""
+    
+    def tile(self, tx, ty):
+        """Tile id at tile coordinates (0 outside the resident columns)"""
+        i = tx - self.origin
+        if 0 <= i < self.columns and 0 <= ty < self.height:
+            return self.tilemap[ty * self.columns + i]
+        return 0
+    
+    def column(self, tx):
+        """Tiles of one column, top to bottom"""
+        i = tx - self.origin
+        if not 0 <= i < self.columns:
+            return bytes(self.height)
+        return bytes(self.tilemap[i::self.columns])
+    
+    def build_collision(self):
+        """Solid bitmap and per-column floor index for O(1) tile queries
+        
+        solid is row-major like the tilemap, one byte per tile. floor_index
+        holds, for each column, the first solid row at or below every row
+        (height when the column is open to the bottom); surface is its top
+        entry. Both cover the resident columns only.
+        """
+        columns, height = self.columns, self.height
+        if numpy is None:
+            self.solid = bytearray(bytes(self.tilemap).translate(SOLID_TILES))
+            self.floor_index = bytearray(columns * (height + 1))
+            self.surface = bytearray(columns)
+            for i in range(columns):
+                self._index_column(i)
+            return
+        tiles = numpy.frombuffer(self.tilemap, numpy.uint8).reshape(height, columns)
+        solid = tiles != 0
+        self.solid = bytearray(solid.tobytes())
+        rows = numpy.where(solid.T != 0, numpy.arange(height, dtype=numpy.uint8), height)
+        index = numpy.full((columns, height + 1), height, dtype=numpy.uint8)
+        index[:, :height] = numpy.minimum.accumulate(rows[:, ::-1], axis=1)[:, ::-1]
+        self.floor_index = bytearray(index.tobytes())
+        self.surface = bytearray(index[:, 0].tobytes())
+    
+    def _index_column(self, i):
+        """Rebuild collision for resident column i (tx - origin)"""
+        columns, height = self.columns, self.height
+        base = i * (height + 1)
+        floor = height
+        self.floor_index[base + height] = height
+        for ty in range(height - 1, -1, -1):
+            solid = self.tilemap[ty * columns + i] > 0
+            self.solid[ty * columns + i] = solid
+            if solid:
+                floor = ty
+            self.floor_index[base + ty] = floor
+        self.surface[i] = floor
+    
+    def solid_tile(self, tx, ty):
+        """Solid tile test; the level sides are walls, above and below are open"""
+        i = tx - self.origin
+        if not 0 <= i < self.columns:
+            return True
+        if not 0 <= ty < self.height:
+            return False
+        return self.solid[ty * self.columns + i] != 0
+    
+    def floor_row(self, tx, ty):
+        """First solid row at or below ty in column tx"""
+        i = min(max(tx - self.origin, 0), self.columns - 1)
+        ty = min(max(ty, 0), self.height)
+        return self.floor_index[i * (self.height + 1) + ty]
     
     def spawn_enemies(self):
-        """Spawn Koopa enemies"""
-        for x in range(20, self.width * TILE_SIZE, 200):
-            y = 180  # Simple placement
-            self.enemies.append(KoopaNES(x, y, self.world))
+        """Build the spawn index; koopas wake up in activate()"""
+        if self.spawns is None:
+            # Simple placement
+            self.spawns = [(x, 180, self.world)
+                           for x in range(20, self.width * TILE_SIZE, 200)]
+        self.spawns.sort(key=lambda spawn: spawn[0])
+        self.spawn_cursor = 0
+    
+    def activate(self, cam_x):
+        """Wake the spawns entering the window, despawn koopas that left it
+        
+        Like the NES, each spawn fires once as the window reaches it (one
+        cursor step per spawn), and a despawned koopa stays gone.
+        """
+        left = cam_x - self.ACTIVE_MARGIN
+        right = cam_x + NES_WIDTH + self.ACTIVE_MARGIN
+        spawns, i = self.spawns, self.spawn_cursor
+        while i < len(spawns) and spawns[i][0] < right:
+            x, y, color_type = spawns[i]
+            if x >= left:
+                self.enemies.spawn(x, y, color_type)
+            i += 1
+        self.spawn_cursor = i
+        self.enemies.despawn(left, right)
     
     def get_tile(self, x, y):
         """Get tile at position"""
-        tx = x // TILE_SIZE
-        ty = y // TILE_SIZE
-        if 0 <= tx < self.width and 0 <= ty < self.height:
-            return self.tilemap[ty][tx]
-        return 0
+        return self.tile(x // TILE_SIZE, y // TILE_SIZE)
+    
+    def set_tile(self, tx, ty, tile):
+        """Edit one tilemap cell (e.g. a hit question block)"""
+        i = tx - self.origin
+        if 0 <= i < self.columns and 0 <= ty < self.height:
+            self.edits.setdefault((tx, ty), self.tilemap[ty * self.columns + i])
+            self.tilemap[ty * self.columns + i] = tile
+            self._index_column(i)
+            self.nametable.mark_dirty(tx, ty)
+    
+    def edited_cells(self):
+        """(tx, ty, tile) for every cell that differs from the generated level"""
+        cells = [(tx, ty, self.tile(tx, ty)) for tx, ty in self.edits]
+        return [cell for cell in cells if cell[2] != self.edits[cell[:2]]]
+    
+    def restore_edits(self, cells):
+        """Make the edited cells match a saved edited_cells() list"""
+        wanted = {(tx, ty): tile for tx, ty, tile in cells}
+        for cell, tile in list(self.edits.items()):
+            if cell not in wanted:
+                self.set_tile(cell[0], cell[1], tile)
+                del self.edits[cell]
+        for (tx, ty), tile in wanted.items():
+            if self.tile(tx, ty) != tile:
+                self.set_tile(tx, ty, tile)
+    
+    def resident_spawns(self):
+        """Spawns a save state has to carry (fixed levels keep all of theirs)"""
+        return ()
+    
+    def restore_window(self, origin, columns, spawns):
+        """Return to a saved resident window (always every column here)"""
+    
+    def tile_rects(self):
+        """Atlas rect per tile id, with this level's world colors in the bank"""
+        pal = WORLD_PALETTES[self.world % len(WORLD_PALETTES)]
+        TILE_ATLAS.set_palette("world", pal['fg'])
+        brick = TILE_ATLAS.get("brick", "world")
+        pipe = TILE_ATLAS.get("pipe", self.PIPE_PALETTE)
+        # Question blocks flash to solid by palette cycle
+        question = TILE_ATLAS.get_cycle("question", ("question", "solid"),
+                                        self.QUESTION_PALETTE)
+        return (None, brick, pipe, question)
     
     def draw(self, surface, cam_x):
         """Draw visible tiles"""
-        # Calculate visible range
-        start_x = max(0, cam_x // TILE_SIZE - 1)
-        end_x = min(self.width, (cam_x + NES_WIDTH) // TILE_SIZE + 2)
-        
         pal = WORLD_PALETTES[self.world % len(WORLD_PALETTES)]
         
         # Draw background elements first (parallax clouds/hills)
@@ -596,41 +1746,840 @@ class NESLevel:
             pygame.draw.circle(surface, NES_PALETTE[pal['bg'] + 1], 
                              (cloud_x - 10, cloud_y), 10)
         
-        # Draw tiles
-        for y in range(self.height):
-            for x in range(start_x, end_x):
-                tile = self.tilemap[y][x]
-                if tile > 0:
-                    screen_x = x * TILE_SIZE - cam_x
-                    screen_y = y * TILE_SIZE
-                    
-                    if tile == 1:  # Solid block
-                        tile_data = PatternTable.make_tile("brick")
-                        tile_surf = PatternTable.render_tile(tile_data, pal['fg'])
-                        surface.blit(tile_surf, (screen_x, screen_y))
-                    elif tile == 2:  # Pipe
-                        tile_data = PatternTable.make_tile("pipe")
-                        # Pipes get special green palette
-                        pipe_pal = [0x0F, 0x1A, 0x2A, 0x3A]
-                        tile_surf = PatternTable.render_tile(tile_data, pipe_pal)
-                        surface.blit(tile_surf, (screen_x, screen_y))
-                    elif tile == 3:  # Question block
-                        # Animate question blocks
-                        frame = (pygame.time.get_ticks() // 500) % 2
-                        if frame == 0:
-                            tile_data = PatternTable.make_tile("question")
-                        else:
-                            tile_data = PatternTable.make_tile("solid")
-                        # Question blocks are yellow
-                        q_pal = [0x0F, 0x27, 0x37, 0x30]
-                        tile_surf = PatternTable.render_tile(tile_data, q_pal)
-                        surface.blit(tile_surf, (screen_x, screen_y))
+        # Draw tiles (animate question blocks) - tile_rects() first, it
+        # stores the question cycle again after an atlas invalidate()
+        rects = self.tile_rects()
+        TILE_ATLAS.set_frame("question", pygame.time.get_ticks() // 500)
+        self.nametable.draw(surface, cam_x, rects)
+
+class StreamingLevel(NESLevel):
+    """Endless level generated chunk by chunk as the camera moves
+    
+    Each chunk is a pure function of (world, level_num, chunk index).
+    Only the chunks around the camera stay resident: the tilemap and
+    collision tables cover [origin, origin + columns) and slide forward,
+    dropping everything left behind. Koopas live in the activation
+    window, which always sits inside.
+    """
+    CHUNK = 64  # Columns per chunk
+    BEHIND = 1  # Chunks kept left of the camera
+    AHEAD = 1  # Chunks kept past the right screen edge
+    LOOKBEHIND = 4  # Platforms reach this far into the next columns
+    WIDTH = 1 << 24  # In tiles - far enough to never reach the goal
+    
+    def __init__(self, world, level_num):
+        self.chunks = OrderedDict()  # Chunk index -> row-major tile bytes
+        super().__init__(world, level_num, width=self.WIDTH, spawns=[])
+    
+    def roll(self, x, a, b):
+        """Random draw for feature column x, independent of load order"""
+        return random.Random((self.world * 100 + self.level_num) << 24 | x).randint(a, b)
+    
+    def generate(self):
+        """Load the chunks visible from the level start"""
+        self.origin = self.columns = 0
+        self.stream(0)
+    
+    def generate_chunk(self, index):
+        """Tiles of chunk index, row-major with stride CHUNK"""
+        return bytes(generate_tiles(index * self.CHUNK, self.CHUNK, self.height,
+                                    self.roll, self.LOOKBEHIND, PIPE_APPROACH))
+    
+    def spawn_chunk(self, index):
+        """Add the chunk's koopas to the spawn index (chunks arrive in x order)"""
+        left = index * self.CHUNK * TILE_SIZE
+        for x in range(left + (20 - left) % 200, left + self.CHUNK * TILE_SIZE, 200):
+            self.spawns.append((x, 180, self.world))
+    
+    def stream(self, cam_x):
+        """Generate the chunks around the camera and evict the rest"""
+        px = self.CHUNK * TILE_SIZE
+        first = max(0, cam_x // px - self.BEHIND)
+        last = (cam_x + NES_WIDTH - 1) // px + self.AHEAD
+        if self.chunks and next(iter(self.chunks)) == first and next(reversed(self.chunks)) == last:
+            return
+        
+        # Chunks only ever enter on the right (the camera cannot go back
+        # past origin), so a chunk is generated and spawned exactly once
+        while self.chunks and next(iter(self.chunks)) < first:
+            self.chunks.popitem(last=False)
+        for tx, ty in [cell for cell in self.edits if cell[0] < first * self.CHUNK]:
+            del self.edits[tx, ty]
+        # Fired spawns and those left behind never wake up again
+        skip = max(self.spawn_cursor, bisect.bisect_left(self.spawns, (first * px,)))
+        del self.spawns[:skip]
+        self.spawn_cursor = 0
+        index = next(reversed(self.chunks)) + 1 if self.chunks else first
+        for index in range(index, last + 1):
+            self.chunks[index] = self.generate_chunk(index)
+            self.spawn_chunk(index)
+        self.compose()
+    
+    def compose(self):
+        """Recompose the resident window row by row (edits live in the chunks)"""
+        chunk = self.CHUNK
+        chunks = list(self.chunks.values())
+        self.origin = next(iter(self.chunks)) * chunk
+        self.columns = len(chunks) * chunk
+        self.tilemap = bytearray(b''.join(tiles[y * chunk:(y + 1) * chunk]
+                                          for y in range(self.height) for tiles in chunks))
+        self.build_collision()
+    
+    def set_tile(self, tx, ty, tile):
+        """Edit one cell; the owning chunk keeps the edit while resident"""
+        index, i = divmod(tx, self.CHUNK)
+        if index in self.chunks and 0 <= ty < self.height:
+            tiles = bytearray(self.chunks[index])
+            tiles[ty * self.CHUNK + i] = tile
+            self.chunks[index] = bytes(tiles)
+        super().set_tile(tx, ty, tile)
+    
+    def resident_spawns(self):
+        return self.spawns
+    
+    def restore_window(self, origin, columns, spawns):
+        """Regenerate the saved chunks if the window has moved since"""
+        if (origin, columns) != (self.origin, self.columns):
+            first = origin // self.CHUNK
+            self.chunks = OrderedDict((index, self.generate_chunk(index))
+                                      for index in range(first, first + columns // self.CHUNK))
+            self.edits.clear()  # Every chunk is fresh from the generator
+            self.compose()
+            self.nametable.invalidate()
+        self.spawns = list(spawns)
+
+# ---------------------------------------------
+# Level Files (binary format + on-disk cache)
+# ---------------------------------------------
+# Header, then the width * height tilemap, the collision tables (solid,
+# floor_index, surface - see NESLevel.build_collision) and the spawn table
+LEVEL_MAGIC = b'KOOP'
+LEVEL_FORMAT = 2
+GENERATOR_VERSION = 2  # Bump whenever NESLevel.generate output changes
+LEVEL_HEADER = struct.Struct('<4sHHBBIHI')  # magic, format, generator, world, level, width, height, spawns
+LEVEL_SPAWN = struct.Struct('<iiB')  # x, y, color_type
+
+def save_level(level, path):
+    """Write a level file (atomically, so a cache never sees half a file)"""
+    header = LEVEL_HEADER.pack(LEVEL_MAGIC, LEVEL_FORMAT, GENERATOR_VERSION,
+                               level.world, level.level_num, level.width,
+                               level.height, len(level.spawns))
+    spawns = b''.join(LEVEL_SPAWN.pack(int(x), int(y), color_type)
+                      for x, y, color_type in level.spawns)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.write(level.tilemap)
+            f.write(level.solid)
+            f.write(level.floor_index)
+            f.write(level.surface)
+            f.write(spawns)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def load_level(path):
+    """Open a level file through mmap
+    
+    The tilemap and collision tables are memoryviews straight into a
+    copy-on-write mapping: nothing is copied or built, pages are read as
+    they are touched, and set_tile never reaches the file.
+    """
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    if len(data) < LEVEL_HEADER.size:
+        raise ValueError(f"{path}: truncated level header")
+    (magic, fmt, generator, world, level_num,
+     width, height, spawn_count) = LEVEL_HEADER.unpack_from(data)
+    if magic != LEVEL_MAGIC or fmt != LEVEL_FORMAT:
+        raise ValueError(f"{path}: not a version {LEVEL_FORMAT} level file")
+    if height != 30:
+        raise ValueError(f"{path}: unsupported level height {height}")
+    view = memoryview(data)
+    sizes = (width * height, width * height, width * (height + 1), width)
+    tables = []
+    end = LEVEL_HEADER.size
+    for size in sizes:
+        tables.append(view[end:end + size])
+        end += size
+    if len(data) < end + spawn_count * LEVEL_SPAWN.size:
+        raise ValueError(f"{path}: truncated level data")
+    spawns = [LEVEL_SPAWN.unpack_from(data, end + i * LEVEL_SPAWN.size)
+              for i in range(spawn_count)]
+    level = NESLevel(world, level_num, width, tables[0], spawns, tables[1:])
+    level.generator = generator
+    return level
+
+class LevelCache:
+    """Generated levels on disk, keyed by (world, level_num, generator version)"""
+    
+    def __init__(self, directory):
+        self.directory = directory  # None disables the cache
+    
+    def path(self, world, level_num):
+        return os.path.join(self.directory,
+                            f"w{world}-{level_num}-g{GENERATOR_VERSION}.lvl")
+    
+    def get(self, world, level_num):
+        """Load the cached level, generating (and caching) it on a miss"""
+        if self.directory is None:
+            return NESLevel(world, level_num)
+        path = self.path(world, level_num)
+        try:
+            level = load_level(path)
+            if level.generator == GENERATOR_VERSION:
+                return level
+        except (OSError, ValueError, struct.error):
+            pass  # Missing or stale - regenerate below
+        level = NESLevel(world, level_num)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            save_level(level, path)
+        except OSError:
+            pass  # Read-only cabinets still run, just uncached
+        return level
+    
+    def headless(self):
+        """Headless runs only cache where KOOPA_LEVEL_CACHE points, never under ~"""
+        if "KOOPA_LEVEL_CACHE" not in os.environ:
+            self.directory = None
+
+# KOOPA_LEVEL_CACHE overrides the directory; set it empty to disable caching.
+# Headless runs and VectorEnv workers cache only when it is set.
+LEVEL_CACHE = LevelCache(os.environ.get(
+    "KOOPA_LEVEL_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "koopa-engine", "levels")) or None)
+
+# ---------------------------------------------
+# Performance Instrumentation
+# ---------------------------------------------
+class FrameStats:
+    """Frame budget counters and the debug overlay (F3)
+    
+    The hot paths (nametable columns, atlas tiles, OAM batch, glyphs,
+    layers) add to the counters behind a PERF.enabled check, so disabled
+    they pay one attribute test and nothing is wrapped or patched.
+    """
+    
+    HISTORY = 120  # Frames in the rolling graph
+    
+    def __init__(self):
+        self.enabled = False
+        self.history = deque(maxlen=self.HISTORY)
+        self.draw_ms = 0.0
+        self.last = (0, 0, 0)  # Counters of the last complete frame
+        self.reset()
+    
+    def reset(self):
+        self.update_ms = 0.0  # Summed over every fixed step of the frame
+        self.blits = 0
+        self.set_at = 0
+        self.surfaces = 0
+    
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.reset()
+    
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.history.clear()
+    
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+    
+    def snapshot(self):
+        """Freeze this frame's counters before the overlay adds its own"""
+        self.last = (self.blits, self.set_at, self.surfaces)
+    
+    def end_frame(self, draw_ms):
+        self.draw_ms = draw_ms
+        self.history.append(self.update_ms + draw_ms)
+        self.reset()
+    
+    def draw_overlay(self, surface, level):
+        """Frame graph, update/draw split and counters in the bottom corner
+        
+        ENM is awake koopas (the pool) against the level's spawns.
+        """
+        x, y = 4, NES_HEIGHT - 64
+        surface.fill(NES_PALETTE[0x0F], (x - 2, y - 2, 18 * 8 + 4, 62))
+        
+        # Rolling frame time graph, 1px per ms against the 16.6ms budget
+        base = y + 58
+        budget = 1000 / FPS
+        for i, ms in enumerate(self.history):
+            color = NES_PALETTE[0x2A if ms <= budget else 0x16]
+            pygame.draw.line(surface, color, (x + i, base),
+                             (x + i, base - min(int(ms), 32)))
+        pygame.draw.line(surface, NES_PALETTE[0x27], (x, base - int(budget)),
+                         (x + self.HISTORY - 1, base - int(budget)))
+        
+        blits, set_at, surfaces = self.last
+        active = len(level.enemies) if level else 0
+        spawns = len(level.spawns) if level else 0
+        color = NES_PALETTE[0x30]
+        FONT.draw(surface, f"U{self.update_ms:5.2f} D{self.draw_ms:5.2f}", x, y, color)
+        FONT.draw(surface, f"BLT{blits:4d} SET{set_at:3d}", x, y + 8, color)
+        FONT.draw(surface, f"SRF{surfaces:3d} ENM{active:3d}/{spawns}", x, y + 16, color)
+
+PERF = FrameStats()
+
+class StartupProfile:
+    """Time to first frame, broken down by phase (--startup-profile)
+    
+    The clock starts when this module is imported. Each mark() ends the
+    phase that ran since the previous one; the first presented frame ends
+    startup. Subsystems opened lazily (audio) are timed on their own and
+    listed apart, since they may open long after the first frame.
+    """
+    
+    def __init__(self, start):
+        self.last = self.start = start
+        self.phases = []  # (name, seconds) up to the first frame
+        self.lazy_phases = []  # (name, seconds) of lazily opened subsystems
+        self.first_frame = None  # Seconds from import to the first frame
+    
+    def mark(self, name, now=None):
+        if self.first_frame is not None:
+            return
+        now = time.perf_counter() if now is None else now
+        self.phases.append((name, now - self.last))
+        self.last = now
+    
+    def lazy(self, name, seconds):
+        self.lazy_phases.append((name, seconds))
+    
+    def frame(self):
+        """End startup at the first presented frame"""
+        if self.first_frame is None:
+            self.mark("first frame")
+            self.first_frame = self.last - self.start
+    
+    def lines(self):
+        total = self.first_frame if self.first_frame is not None else self.last - self.start
+        lines = [f"startup: {total * 1000:.1f}ms to "
+                 + ("first frame" if self.first_frame is not None else "last mark (no frame drawn)")]
+        lines += [f"  {name:<16}{seconds * 1000:8.1f}ms" for name, seconds in self.phases]
+        lines += [f"  {name + ' (lazy)':<16}{seconds * 1000:8.1f}ms" for name, seconds in self.lazy_phases]
+        return lines
+
+STARTUP = StartupProfile(IMPORT_START)
+STARTUP.mark("import pygame", PYGAME_IMPORTED)
+
+# ---------------------------------------------
+# Frame Capture (video dump)
+# ---------------------------------------------
+class FrameCapture:
+    """Records drawn frames without stalling the game loop
+    
+    grab() copies DISPLAY through the buffer interface into a free slot of
+    a pre-allocated ring; a writer thread appends the slots to a raw video
+    stream or saves them as a PNG sequence. When every slot is still
+    waiting on the writer the frame is dropped and counted instead.
+    Each counter has one writing thread: dropped is the game's, written
+    and failed (frames lost after a write error) the writer's.
+    
+    Raw streams have no header; play them with
+    ffmpeg -f rawvideo -pix_fmt <pixel_format> -s 256x240 -r 60 -i FILE
+    """
+    
+    RING = 30  # Frames buffered for the writer (half a second)
+    FORMATS = ("raw", "png")
+    
+    def __init__(self):
+        self.active = False
+        self.thread = None
+        self.error = None
+    
+    def start(self, path, fmt="raw", ring=RING, surface=None):
+        """Begin recording frames like surface (DISPLAY) to path"""
+        if fmt not in self.FORMATS:
+            raise ValueError(f"capture format must be one of {', '.join(self.FORMATS)}")
+        self.stop()
+        surface = surface or DISPLAY
+        self.path = path
+        self.format = fmt
+        self.pixel_format = self.pixel_format_of(surface)
+        self.slots = [memoryview(bytearray(surface.get_pitch() * surface.get_height()))
+                      for _ in range(ring)]
+        self.free = deque(range(ring))  # Slots the game may fill
+        self.filled = queue.Queue()  # Slots waiting on the writer, None stops it
+        self.grabbed = self.written = self.dropped = self.failed = 0
+        self.error = None
+        self.geometry = surface.get_size() + (surface.get_pitch(),)
+        if fmt == "raw":
+            self.file = open(path, 'wb')
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.file = None
+        self.thread = threading.Thread(target=self._writer, name="frame-capture", daemon=True)
+        self.thread.start()
+        self.active = True
+    
+    @staticmethod
+    def pixel_format_of(surface):
+        """ffmpeg pixel format of a 32-bit surface's bytes (e.g. bgr0)"""
+        masks = surface.get_masks()
+        return ''.join(next((name for name, mask in zip("rgb", masks) if mask == 0xff << (8 * i)), '0')
+                       for i in range(4))
+    
+    def grab(self, surface):
+        """Queue a copy of surface; False (and counted) if the ring is full"""
+        try:
+            slot = self.free.popleft()
+        except IndexError:
+            self.dropped += 1
+            return False
+        self.slots[slot][:] = surface.get_buffer()
+        self.grabbed += 1
+        self.filled.put(slot)
+        return True
+    
+    def _writer(self):
+        while True:
+            slot = self.filled.get()
+            if slot is None:
+                break
+            if self.error is None:
+                try:
+                    if self.file is not None:
+                        self.file.write(self.slots[slot])
+                    else:
+                        png = encode_png(self.slots[slot], *self.geometry, self.pixel_format)
+                        with open(os.path.join(self.path, f"frame_{self.written:06d}.png"), 'wb') as f:
+                            f.write(png)
+                    self.written += 1
+                except OSError as exc:
+                    self.error = exc  # Disk full and the like: keep the game running
+            if self.error is not None:
+                self.failed += 1
+            self.free.append(slot)
+    
+    def stop(self):
+        """Flush queued frames and close; returns the counters"""
+        if self.thread is None:
+            return None
+        self.active = False
+        self.filled.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.file is not None:
+            self.file.close()
+        return {
+            'path': self.path,
+            'format': self.format,
+            'pixel_format': self.pixel_format,
+            'grabbed': self.grabbed,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'error': self.error,
+        }
+
+CAPTURE = FrameCapture()
+
+def encode_png(pixels, width, height, pitch, pixel_format):
+    """PNG file bytes for a 32-bit frame (stdlib only)
+    
+    The heavy part is zlib, which lets go of the GIL, so a writer thread
+    encoding frames does not hold up the game loop.
+    """
+    rows = pixels if pitch == width * 4 else b''.join(
+        pixels[y * pitch:y * pitch + width * 4] for y in range(height))
+    rgb = bytearray(width * height * 3)
+    for i, channel in enumerate("rgb"):
+        rgb[i::3] = rows[pixel_format.index(channel)::4]
+    stride = width * 3
+    raw = b''.join(b'\x00' + rgb[y * stride:(y + 1) * stride] for y in range(height))
+    
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data)))
+    return b''.join((b'\x89PNG\r\n\x1a\n',
+                     chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+                     chunk(b'IDAT', zlib.compress(raw, 6)),
+                     chunk(b'IEND', b'')))
+
+# ---------------------------------------------
+# Controller Input
+# ---------------------------------------------
+# Buttons in NES controller shift-register order: A, B, Select, Start, dpad
+BUTTONS = (pygame.K_z, pygame.K_x, pygame.K_RSHIFT, pygame.K_RETURN,
+           pygame.K_UP, pygame.K_DOWN, pygame.K_LEFT, pygame.K_RIGHT)
+BUTTON_A, BUTTON_B, BUTTON_SELECT, BUTTON_START = 0x01, 0x02, 0x04, 0x08
+BUTTON_UP, BUTTON_DOWN, BUTTON_LEFT, BUTTON_RIGHT = 0x10, 0x20, 0x40, 0x80
+
+class Controller(frozenset):
+    """Held keys, indexable like pygame.key.get_pressed()"""
+    
+    def __getitem__(self, key):
+        return key in self
+    
+    @classmethod
+    def from_mask(cls, mask):
+        return cls(key for i, key in enumerate(BUTTONS) if mask & (1 << i))
+
+def controller_mask(keys):
+    """Pack held keys into a one byte NES controller state"""
+    mask = 0
+    for i, key in enumerate(BUTTONS):
+        if keys[key]:
+            mask |= 1 << i
+    if keys[pygame.K_SPACE]:
+        mask |= BUTTON_START
+    return mask
+
+class KeyboardInput:
+    """Live keyboard"""
+    
+    def poll(self):
+        return pygame.key.get_pressed()
+
+class ScriptedInput:
+    """Replay one controller byte per frame (scripted or recorded)"""
+    
+    def __init__(self, masks, loop=False):
+        self.masks = bytes(masks)
+        self.loop = loop
+        self.frame = 0
+        self.states = {}  # mask -> Controller
+    
+    @classmethod
+    def load(cls, path, loop=False):
+        with open(path, 'rb') as f:
+            return cls(f.read(), loop)
+    
+    @classmethod
+    def demo(cls):
+        """Press start, then run right hopping every 40 frames"""
+        run = BUTTON_B | BUTTON_RIGHT
+        masks = [BUTTON_START] + [run | (BUTTON_A if i % 40 < 20 else 0)
+                                  for i in range(600)]
+        return cls(masks, loop=True)
+    
+    def poll(self):
+        if self.frame >= len(self.masks):
+            if not self.loop or not self.masks:
+                return Controller()
+            self.frame = 0
+        mask = self.masks[self.frame]
+        self.frame += 1
+        state = self.states.get(mask)
+        if state is None:
+            state = self.states[mask] = Controller.from_mask(mask)
+        return state
+
+class SharedInput:
+    """Controller byte read from a shared buffer each frame (VectorEnv actions)"""
+    
+    def __init__(self, masks, index):
+        self.masks = masks
+        self.index = index
+        self.states = {}  # mask -> Controller
+    
+    def poll(self):
+        mask = self.masks[self.index]
+        state = self.states.get(mask)
+        if state is None:
+            state = self.states[mask] = Controller.from_mask(mask)
+        return state
+
+class InputRecorder:
+    """Wrap an input source and record what it returned each frame"""
+    
+    def __init__(self, source):
+        self.source = source
+        self.masks = bytearray()
+    
+    def poll(self):
+        keys = self.source.poll()
+        self.masks.append(controller_mask(keys))
+        return keys
+    
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.masks)
+
+# ---------------------------------------------
+# Static Layers (cached screen chrome)
+# ---------------------------------------------
+class LayerCache:
+    """Surfaces for the parts of a screen that never change between frames
+    
+    Each layer is painted once by its painter and then composited with a
+    single blit; dynamic parts are drawn over it.
+    """
+    
+    def __init__(self):
+        self.layers = {}  # name -> painted surface
+    
+    def get(self, name, size, painter):
+        layer = self.layers.get(name)
+        if layer is None:
+            layer = pygame.Surface(size).convert()
+            painter(layer)
+            self.layers[name] = layer
+            if PERF.enabled:
+                PERF.surfaces += 1
+        return layer
+    
+    def blit(self, surface, name, size, painter, pos=(0, 0)):
+        surface.blit(self.get(name, size, painter), pos)
+        if PERF.enabled:
+            PERF.blits += 1
+    
+    def invalidate(self, name=None):
+        """Repaint one layer (or all) on next use"""
+        if name is None:
+            self.layers.clear()
+        else:
+            self.layers.pop(name, None)
+
+LAYERS = LayerCache()
+
+# ---------------------------------------------
+# Presentation (scale + flip, or dirty rects)
+# ---------------------------------------------
+class DirtyRects:
+    """Regions of a surface that changed since the last call
+    
+    The pixels are compared with a copy of the previous frame in BLOCK-sized
+    cells; changed cells are merged into horizontal runs, and runs spanning
+    the same columns on consecutive block rows into one rect.
+    """
+    BLOCK = 16
+    
+    def __init__(self):
+        self.last = None  # Raw pixels of the previous frame
+    
+    def reset(self):
+        """Treat the next frame as entirely changed"""
+        self.last = None
+    
+    def diff(self, surface):
+        width, height = surface.get_size()
+        pixels = surface.get_buffer().raw
+        last, self.last = self.last, pixels
+        if last is None or len(last) != len(pixels):
+            return [pygame.Rect(0, 0, width, height)]
+        if last == pixels:
+            return []
+        
+        block = self.BLOCK
+        cols, rows = -(-width // block), -(-height // block)
+        pitch = surface.get_pitch()
+        if numpy is not None and height % block == 0:
+            # Compare whole pixels where they are 32-bit, bytes otherwise
+            dtype, unit = ((numpy.uint32, 1) if surface.get_bytesize() == 4 and pitch % 4 == 0
+                           else (numpy.uint8, surface.get_bytesize()))
+            span = pitch // numpy.dtype(dtype).itemsize
+            changed = (numpy.frombuffer(pixels, dtype).reshape(height, span)[:, :width * unit]
+                       != numpy.frombuffer(last, dtype).reshape(height, span)[:, :width * unit])
+            # Block rows first (long contiguous runs), then columns
+            changed = changed.reshape(rows, block, width * unit).any(axis=1)
+            dirty = numpy.logical_or.reduceat(changed, numpy.arange(0, width * unit, block * unit),
+                                              axis=1).tolist()
+        else:
+            step = block * surface.get_bytesize()
+            dirty = [[False] * cols for _ in range(rows)]
+            for y in range(height):
+                start = y * pitch
+                if pixels[start:start + pitch] == last[start:start + pitch]:
+                    continue
+                row = dirty[y // block]
+                for col in range(cols):
+                    if not row[col]:
+                        a, b = start + col * step, min(start + (col + 1) * step, start + pitch)
+                        row[col] = pixels[a:b] != last[a:b]
+        
+        rects = []
+        above = {}  # (first, last) column run -> rect from the block row above
+        for r, row in enumerate(dirty):
+            runs = {}
+            col = 0
+            while col < cols:
+                if not row[col]:
+                    col += 1
+                    continue
+                first = col
+                while col < cols and row[col]:
+                    col += 1
+                rect = above.get((first, col))
+                if rect is not None:
+                    rect.height = min((r + 1) * block, height) - rect.y
+                else:
+                    rect = pygame.Rect(first * block, r * block,
+                                       min(col * block, width) - first * block,
+                                       min(block, height - r * block))
+                    rects.append(rect)
+                runs[(first, col)] = rect
+            above = runs
+        return rects
+
+class CachedUpscaler:
+    """Nearest-neighbor scaling straight into the window surface
+    
+    The destination is the cached SCREEN itself, so nothing is
+    allocated per frame.
+    """
+    NAME = "cached"
+    DIRTY_RECTS = True  # Can scale a sub-rect on its own
+    
+    def __init__(self, scale):
+        self.scale = scale
+    
+    def set_mode(self):
+        return pygame.display.set_mode((NES_WIDTH * self.scale, NES_HEIGHT * self.scale))
+    
+    def scale_full(self, display, screen):
+        pygame.transform.scale(display, screen.get_size(), screen)
+    
+    def scale_rect(self, display, screen, rect):
+        """Scale one DISPLAY rect, returning the SCREEN rect it covers"""
+        scale = self.scale
+        target = pygame.Rect(rect.x * scale, rect.y * scale,
+                             rect.width * scale, rect.height * scale)
+        pygame.transform.scale(display.subsurface(rect), target.size,
+                               screen.subsurface(target))
+        return target
+
+class ScaledModeUpscaler(CachedUpscaler):
+    """The display's own SCALED mode: SCREEN stays 256x240 and SDL
+    scales on present (nearest, usually on the GPU)"""
+    NAME = "scaled"
+    
+    def set_mode(self):
+        try:
+            screen = pygame.display.set_mode((NES_WIDTH, NES_HEIGHT), pygame.SCALED)
+        except pygame.error:
+            # SDL cannot add a renderer to a window opened without one
+            caption = pygame.display.get_caption()
+            pygame.display.quit()
+            pygame.display.init()
+            pygame.display.set_caption(*caption)
+            screen = pygame.display.set_mode((NES_WIDTH, NES_HEIGHT), pygame.SCALED)
+        try:
+            from pygame._sdl2.video import Window
+            Window.from_display_module().size = (NES_WIDTH * self.scale, NES_HEIGHT * self.scale)
+        except (ImportError, pygame.error):
+            pass  # SDL picks the largest integer scale that fits
+        return screen
+    
+    def scale_full(self, display, screen):
+        screen.blit(display, (0, 0))
+    
+    def scale_rect(self, display, screen, rect):
+        screen.blit(display, rect, rect)
+        return rect
+
+class Scale2xUpscaler(CachedUpscaler):
+    """Software scale2x (EPX) smoothing, one pass per doubling
+    
+    Scales that are not a power of two finish with a nearest-neighbor
+    pass from the largest doubling below them (3x = 2x, then 1.5x).
+    """
+    NAME = "scale2x"
+    DIRTY_RECTS = False  # Each pixel depends on its neighbors
+    
+    def set_mode(self):
+        screen = super().set_mode()
+        # Pre-allocated intermediate for every doubling short of the window
+        size = (NES_WIDTH, NES_HEIGHT)
+        self.passes = []
+        while size[0] * 2 <= screen.get_width():
+            size = (size[0] * 2, size[1] * 2)
+            self.passes.append(pygame.Surface(size).convert())
+        if self.passes and self.passes[-1].get_size() == screen.get_size():
+            self.passes[-1] = None  # Last doubling writes into SCREEN
+        return screen
+    
+    def scale_full(self, display, screen):
+        source = display
+        for dest in self.passes:
+            source = pygame.transform.scale2x(source, dest if dest is not None else screen)
+        if source is not screen:
+            pygame.transform.scale(source, screen.get_size(), screen)
+
+UPSCALERS = {upscaler.NAME: upscaler
+             for upscaler in (CachedUpscaler, ScaledModeUpscaler, Scale2xUpscaler)}
+
+class Presenter:
+    """Scale DISPLAY into SCREEN and put it on the screen
+    
+    Scaling goes through the selected upscaler backend. Full mode scales
+    the whole frame and flips. Dirty-rect mode scales only the changed
+    regions and passes them to display.update(), and skips frames where
+    nothing changed. Frames that changed over more than FULL_AREA of the
+    screen (scrolling), or backends that cannot scale a rect on its own,
+    are presented in full.
+    """
+    FULL_AREA = 0.5
+    
+    def __init__(self):
+        self.upscaler = CachedUpscaler(SCALE)  # Window opened by init()
+        self.dirty_rects = False
+        self.tracker = DirtyRects()
+        self.skipped = 0  # Frames not presented (nothing changed)
+        self.last_rects = 0  # Rects presented by the last frame
+    
+    def configure(self, scale=None, upscaler=None):
+        """Switch the integer scale and/or upscaler backend (reopens the window)"""
+        global SCREEN, SCALE
+        if scale is None:
+            scale = self.upscaler.scale
+        if scale < 1:
+            raise ValueError(f"scale must be a positive integer, got {scale}")
+        self.upscaler = UPSCALERS[upscaler or self.upscaler.NAME](scale)
+        SCREEN = self.upscaler.set_mode()
+        SCALE = scale
+        self.tracker.reset()
+    
+    def set_dirty_rects(self, enabled):
+        self.dirty_rects = enabled
+        self.tracker.reset()
+    
+    def invalidate(self):
+        """Present the whole next frame (window exposed, mode change)"""
+        self.tracker.reset()
+    
+    def present(self, display):
+        if not self.dirty_rects:
+            self.present_full(display)
+            return
+        rects = self.tracker.diff(display)
+        self.last_rects = len(rects)
+        if not rects:
+            self.skipped += 1
+            return
+        if (not self.upscaler.DIRTY_RECTS or
+                sum(rect.width * rect.height for rect in rects) > self.FULL_AREA * NES_WIDTH * NES_HEIGHT):
+            self.present_full(display)
+            return
+        pygame.display.update([self.upscaler.scale_rect(display, SCREEN, rect) for rect in rects])
+    
+    def present_full(self, display):
+        self.upscaler.scale_full(display, SCREEN)
+        pygame.display.flip()
+
+PRESENTER = Presenter()
 
 # ---------------------------------------------
 # Game State Machine
 # ---------------------------------------------
 class KoopaEngine:
-    def __init__(self):
+    def __init__(self, input_source=None, endless=False):
+        self.input = input_source or KeyboardInput()
+        self.endless = endless  # Streamed levels instead of fixed 256-column ones
         self.state = "TITLE"
         self.world = 0
         self.level_num = 0
@@ -644,6 +2593,7 @@ class KoopaEngine:
         # Title screen animation
         self.title_y = 0
         self.title_flash = 0
+        self.title_koopas = [KoopaNES(0, 0, i) for i in range(3)]
     
     def start_game(self):
         """Initialize game"""
@@ -652,9 +2602,15 @@ class KoopaEngine:
         self.score = 0
         self.start_level()
     
+    def make_level(self):
+        """Fresh level for the current world and level number"""
+        if self.endless:
+            return StreamingLevel(self.world, self.level_num)
+        return LEVEL_CACHE.get(self.world, self.level_num)
+    
     def start_level(self):
         """Start a level"""
-        self.level = NESLevel(self.world, self.level_num)
+        self.level = self.make_level()
         self.player = KoopaPlayer()
         self.camera_x = 0
         self.time = 400
@@ -664,8 +2620,10 @@ class KoopaEngine:
     
     def update(self):
         """Update game logic"""
+        if PERF.enabled:
+            start = time.perf_counter()
         self.frame_counter += 1
-        keys = pygame.key.get_pressed()
+        keys = self.input.poll()
         
         if self.state == "TITLE":
             # Animate title
@@ -681,35 +2639,31 @@ class KoopaEngine:
             # Update player
             self.player.update(keys, self.level)
             
-            # Update enemies
-            for enemy in self.level.enemies:
-                enemy.update(self.level)
-                
-                # Collision with player
-                if enemy.alive:
-                    px = self.player.x
-                    py = self.player.y
-                    ex = enemy.x
-                    ey = enemy.y
-                    
-                    if (abs(px - ex) < 14 and abs(py - ey) < 14):
-                        if self.player.vy > 1 and py < ey:
-                            # Stomp enemy
-                            enemy.alive = False
-                            self.player.vy = -3
-                            self.score += 100
-                        elif self.player.invincible == 0:
-                            # Hurt player
-                            self.player.invincible = 120
-                            self.player.lives -= 1
-                            if self.player.lives <= 0:
-                                self.state = "GAMEOVER"
+            # Update enemies (shell hits score like stomps)
+            self.score += 100 * self.level.enemies.step(self.level)
+            
+            # Collision with player
+            py = self.player.y
+            for enemy in self.level.enemies.touching(self.player.x, py):
+                if self.player.vy > 1 and py < enemy.y:
+                    # Stomp enemy
+                    enemy.alive = False
+                    self.player.vy = -3
+                    self.score += 100
+                elif self.player.invincible == 0:
+                    # Hurt player
+                    self.player.invincible = 120
+                    self.player.lives -= 1
+                    if self.player.lives <= 0:
+                        self.state = "GAMEOVER"
             
             # Update camera (bootleg scrolling)
             target_cam = self.player.x - NES_WIDTH // 2
             self.camera_x += (target_cam - self.camera_x) * 0.1
-            self.camera_x = max(0, min(self.camera_x, 
-                                       self.level.width * TILE_SIZE - NES_WIDTH))
+            self.camera_x = max(self.level.origin * TILE_SIZE,
+                                min(self.camera_x, self.level.width * TILE_SIZE - NES_WIDTH))
+            self.level.stream(int(self.camera_x))
+            self.level.activate(int(self.camera_x))
             
             # Timer
             if self.frame_counter % 60 == 0:
@@ -737,30 +2691,68 @@ class KoopaEngine:
         elif self.state == "WIN":
             if keys[pygame.K_RETURN]:
                 self.state = "TITLE"
+        
+        if PERF.enabled:
+            PERF.update_ms += (time.perf_counter() - start) * 1000
     
     def draw(self):
-        """Render everything"""
-        # Clear with background color
+        """Render everything and put it on the screen"""
+        if PERF.enabled:
+            start = time.perf_counter()
+        if STARTUP.first_frame is None:
+            STARTUP.mark("first update")
+        
+        self.render()
+        
+        if PERF.enabled:
+            PERF.snapshot()
+            PERF.draw_overlay(DISPLAY, self.level)
+        
+        if CAPTURE.active:
+            CAPTURE.grab(DISPLAY)
+        
+        self.present()
+        if STARTUP.first_frame is None:
+            STARTUP.frame()
+        
+        if PERF.enabled:
+            PERF.end_frame((time.perf_counter() - start) * 1000)
+    
+    def render(self):
+        """Draw the frame into DISPLAY
+        
+        One method per phase, so the frame-time suite (bench.py frames)
+        times exactly what the game draws.
+        """
+        self.render_level()
+        self.render_entities()
+        self.render_hud()
+    
+    def render_level(self):
+        """Background color and, in game, the level"""
         pal = WORLD_PALETTES[self.world % len(WORLD_PALETTES)] if self.level else WORLD_PALETTES[0]
         bg_color = NES_PALETTE[pal['bg']]
         DISPLAY.fill(bg_color)
         
+        if self.state == "GAME":
+            self.level.draw(DISPLAY, int(self.camera_x))
+    
+    def render_entities(self):
+        """In game, the player and koopas through OAM"""
+        if self.state == "GAME":
+            # The player first, so it draws on top and enemies are what
+            # get dropped when slots run out
+            self.player.draw(OAM, int(self.camera_x))
+            self.level.enemies.draw(OAM, int(self.camera_x))
+            OAM.render(DISPLAY)
+    
+    def render_hud(self):
+        """HUD in game, otherwise the title or end screen text"""
         if self.state == "TITLE":
             # Title screen (Team Hummer style)
             self.draw_title()
         
         elif self.state == "GAME":
-            # Draw level
-            self.level.draw(DISPLAY, int(self.camera_x))
-            
-            # Draw enemies
-            for enemy in self.level.enemies:
-                enemy.draw(DISPLAY, int(self.camera_x))
-            
-            # Draw player
-            self.player.draw(DISPLAY, int(self.camera_x))
-            
-            # Draw HUD
             self.draw_hud()
         
         elif self.state == "GAMEOVER":
@@ -771,25 +2763,15 @@ class KoopaEngine:
             self.draw_text("KOOPA CHAMPION!", NES_WIDTH // 2 - 56, NES_HEIGHT // 2 - 12)
             self.draw_text("THANK YOU KOOPA!", NES_WIDTH // 2 - 60, NES_HEIGHT // 2 + 4)
             self.draw_text("PRESS START", NES_WIDTH // 2 - 40, NES_HEIGHT // 2 + 20)
-        
-        # Scale up for display
-        pygame.transform.scale(DISPLAY, (NES_WIDTH * SCALE, NES_HEIGHT * SCALE), SCREEN)
-        pygame.display.flip()
+    
+    def present(self):
+        """Scale up for display"""
+        PRESENTER.present(DISPLAY)
     
     def draw_title(self):
         """Draw title screen"""
-        # Gradient background (bootleg style)
-        for y in range(NES_HEIGHT):
-            grad_color = NES_PALETTE[0x0C if y < 80 else 0x01 if y < 160 else 0x00]
-            pygame.draw.line(DISPLAY, grad_color, (0, y), (NES_WIDTH, y))
-        
-        # Background pattern grid
-        for y in range(0, NES_HEIGHT, 32):
-            for x in range(0, NES_WIDTH, 32):
-                if (x // 32 + y // 32) % 2:
-                    tile = PatternTable.make_tile("koopa_shell")
-                    surf = PatternTable.render_tile(tile, [0x11, 0x21, 0x31, 0x30])
-                    DISPLAY.blit(surf, (x + 8, y + 8))
+        # Background, subtitles, box and credits are one cached layer
+        LAYERS.blit(DISPLAY, "title", (NES_WIDTH, NES_HEIGHT), self.paint_title)
         
         # Main Title with shadow
         title = "KOOPA ENGINE"
@@ -800,134 +2782,702 @@ class KoopaEngine:
         self.draw_text(title, NES_WIDTH // 2 - 44, 40 + self.title_y, 
                       color=NES_PALETTE[0x20 if self.title_flash else 0x30])
         
+        # Instructions
+        if self.title_flash:
+            self.draw_text("PRESS START", NES_WIDTH // 2 - 44, 140)
+        
+        # Animated koopas (multiple)
+        for i, koopa in enumerate(self.title_koopas):
+            koopa.x = 40 + i * 80 + int(math.sin(self.frame_counter * 0.05 + i) * 20)
+            koopa.y = 100 + int(math.cos(self.frame_counter * 0.04 + i) * 5)
+            koopa.draw(OAM, 0)
+        OAM.render(DISPLAY)
+    
+    @staticmethod
+    def paint_title(surface):
+        """Static title screen layer"""
+        # Gradient background (bootleg style)
+        for y in range(NES_HEIGHT):
+            grad_color = NES_PALETTE[0x0C if y < 80 else 0x01 if y < 160 else 0x00]
+            pygame.draw.line(surface, grad_color, (0, y), (NES_WIDTH, y))
+        
+        # Background pattern grid
+        for y in range(0, NES_HEIGHT, 32):
+            for x in range(0, NES_WIDTH, 32):
+                if (x // 32 + y // 32) % 2:
+                    TILE_ATLAS.blit(surface, "koopa_shell", (0x11, 0x21, 0x31, 0x30),
+                                    (x + 8, y + 8))
+        
         # Subtitle with shadow
-        self.draw_text("TEAM HUMMER", NES_WIDTH // 2 - 44 + 1, 65 + 1, NES_PALETTE[0x0F])
-        self.draw_text("TEAM HUMMER", NES_WIDTH // 2 - 44, 65, NES_PALETTE[0x16])
+        FONT.draw(surface, "TEAM HUMMER", NES_WIDTH // 2 - 44 + 1, 65 + 1, NES_PALETTE[0x0F])
+        FONT.draw(surface, "TEAM HUMMER", NES_WIDTH // 2 - 44, 65, NES_PALETTE[0x16])
         
-        self.draw_text("BOOTLEG STYLE", NES_WIDTH // 2 - 52 + 1, 80 + 1, NES_PALETTE[0x0F])
-        self.draw_text("BOOTLEG STYLE", NES_WIDTH // 2 - 52, 80, NES_PALETTE[0x1A])
+        FONT.draw(surface, "BOOTLEG STYLE", NES_WIDTH // 2 - 52 + 1, 80 + 1, NES_PALETTE[0x0F])
+        FONT.draw(surface, "BOOTLEG STYLE", NES_WIDTH // 2 - 52, 80, NES_PALETTE[0x1A])
         
         # Box around instructions
-        pygame.draw.rect(DISPLAY, NES_PALETTE[0x30], (NES_WIDTH // 2 - 60, 130, 120, 40), 2)
-        
-        # Instructions
-        if self.title_flash:
-            self.draw_text("PRESS START", NES_WIDTH // 2 - 44, 140)
-        self.draw_text("Z=JUMP X=RUN", NES_WIDTH // 2 - 48, 155)
+        pygame.draw.rect(surface, NES_PALETTE[0x30], (NES_WIDTH // 2 - 60, 130, 120, 40), 2)
+        FONT.draw(surface, "Z=JUMP X=RUN", NES_WIDTH // 2 - 48, 155, NES_PALETTE[0x30])
         
         # Credits
-        self.draw_text("(C)2024 BOOTLEG", NES_WIDTH // 2 - 60, 195, 
-                      color=NES_PALETTE[0x16])
-        self.draw_text("KOOPA CORP", NES_WIDTH // 2 - 40, 205, 
-                      color=NES_PALETTE[0x1A])
-        
-        # Animated koopas (multiple)
-        for i in range(3):
-            koopa_x = 40 + i * 80 + int(math.sin(self.frame_counter * 0.05 + i) * 20)
-            koopa_y = 100 + int(math.cos(self.frame_counter * 0.04 + i) * 5)
-            temp_koopa = KoopaNES(koopa_x, koopa_y, i)
-            temp_koopa.draw(DISPLAY, 0)
+        FONT.draw(surface, "(C)2024 BOOTLEG", NES_WIDTH // 2 - 60, 195, NES_PALETTE[0x16])
+        FONT.draw(surface, "KOOPA CORP", NES_WIDTH // 2 - 40, 205, NES_PALETTE[0x1A])
         
         # Version info
-        self.draw_text("NES 256X240", 4, NES_HEIGHT - 12, NES_PALETTE[0x12])
-        self.draw_text("60FPS", NES_WIDTH - 40, NES_HEIGHT - 12, NES_PALETTE[0x12])
+        FONT.draw(surface, "NES 256X240", 4, NES_HEIGHT - 12, NES_PALETTE[0x12])
+        FONT.draw(surface, "60FPS", NES_WIDTH - 40, NES_HEIGHT - 12, NES_PALETTE[0x12])
     
     def draw_hud(self):
         """Draw HUD (NES style)"""
-        # Top bar with gradient effect
-        for y in range(24):
-            color = NES_PALETTE[0x0F if y < 2 or y > 21 else 0x00]
-            pygame.draw.line(DISPLAY, color, (0, y), (NES_WIDTH, y))
+        # Bar, box, icons and labels are a cached layer
+        LAYERS.blit(DISPLAY, "hud", (NES_WIDTH, 24), self.paint_hud)
         
-        # HUD background box
-        pygame.draw.rect(DISPLAY, NES_PALETTE[0x0F], (2, 2, NES_WIDTH - 4, 20))
-        
-        # Score with icon
-        self.draw_text("$", 8, 7, NES_PALETTE[0x37])
+        # Score
         self.draw_text(f"{self.score:06d}", 16, 7, NES_PALETTE[0x30])
         
         # World indicator
-        self.draw_text("WORLD", NES_WIDTH // 2 - 36, 7, NES_PALETTE[0x36])
         self.draw_text(f"{self.world+1}-{self.level_num+1}", NES_WIDTH // 2 + 4, 7, NES_PALETTE[0x30])
         
-        # Time with clock icon
-        self.draw_text("TIME", NES_WIDTH - 72, 7, NES_PALETTE[0x27])
+        # Time
         time_color = NES_PALETTE[0x16] if self.time < 100 else NES_PALETTE[0x30]
         self.draw_text(f"{self.time:03d}", NES_WIDTH - 40, 7, time_color)
         
         # Lives (bottom of HUD)
-        self.draw_text("KOOPA", 8, 14, NES_PALETTE[0x1A])
-        self.draw_text("X", 48, 14, NES_PALETTE[0x30])
         self.draw_text(f"{self.player.lives:02d}", 56, 14, NES_PALETTE[0x30])
     
+    @staticmethod
+    def paint_hud(surface):
+        """Static HUD layer"""
+        # Top bar with gradient effect
+        for y in range(24):
+            color = NES_PALETTE[0x0F if y < 2 or y > 21 else 0x00]
+            pygame.draw.line(surface, color, (0, y), (NES_WIDTH, y))
+        
+        # HUD background box
+        pygame.draw.rect(surface, NES_PALETTE[0x0F], (2, 2, NES_WIDTH - 4, 20))
+        
+        # Icons and labels
+        FONT.draw(surface, "$", 8, 7, NES_PALETTE[0x37])
+        FONT.draw(surface, "WORLD", NES_WIDTH // 2 - 36, 7, NES_PALETTE[0x36])
+        FONT.draw(surface, "TIME", NES_WIDTH - 72, 7, NES_PALETTE[0x27])
+        FONT.draw(surface, "KOOPA", 8, 14, NES_PALETTE[0x1A])
+        FONT.draw(surface, "X", 48, 14, NES_PALETTE[0x30])
+    
     def draw_text(self, text, x, y, color=None):
         """Draw NES-style text"""
         if color is None:
             color = NES_PALETTE[0x30]  # White
+        FONT.draw(DISPLAY, text, x, y, color)
+
+# ---------------------------------------------
+# Save States
+# ---------------------------------------------
+# Header, then (in a level) the player, window, spawns, koopas (EnemyPool.pack) and edits
+STATE_MAGIC = b'KSAV'
+STATE_FORMAT = 1
+STATE_HEADER = struct.Struct('<4sHBBBBdIIhbBII')  # magic, format, state, world, level, endless, camera, frame, score, time, title y/flash, in level, input frame
+STATE_PLAYER = struct.Struct('<dddd????BBHb')  # x, y, vx, vy, flags, jump buffer, power, invincible, lives
+STATE_LEVEL = struct.Struct('<iIIHHI')  # origin, columns, spawn cursor, spawns, koopas, edits
+STATE_EDIT = struct.Struct('<iBB')  # tx, ty, tile
+ENGINE_STATES = ("TITLE", "GAME", "GAMEOVER", "WIN")
+PLAYER_STATES = ("small", "big", "fire")
+
+def save_state(engine):
+    """Snapshot the engine as a compact binary blob
+    
+    Levels are not stored: they regenerate from (world, level, endless),
+    so only koopas, the streamed window and edited cells are written.
+    """
+    level = engine.level
+    parts = [STATE_HEADER.pack(
+        STATE_MAGIC, STATE_FORMAT, ENGINE_STATES.index(engine.state),
+        engine.world, engine.level_num, engine.endless, engine.camera_x,
+        engine.frame_counter, engine.score, engine.time, engine.title_y,
+        engine.title_flash, level is not None, getattr(engine.input, 'frame', 0))]
+    if level is None:
+        return b''.join(parts)
+    player = engine.player
+    parts.append(STATE_PLAYER.pack(
+        player.x, player.y, player.vx, player.vy, player.on_ground,
+        player.facing_right, player.run_held, player.jump_held,
+        player.jump_buffer, PLAYER_STATES.index(player.state),
+        player.invincible, player.lives))
+    spawns = level.resident_spawns()
+    enemies = level.enemies
+    edits = level.edited_cells()
+    parts.append(STATE_LEVEL.pack(level.origin, level.columns, level.spawn_cursor,
+                                  len(spawns), len(enemies), len(edits)))
+    parts.extend(LEVEL_SPAWN.pack(int(x), int(y), color_type) for x, y, color_type in spawns)
+    parts.append(enemies.pack())
+    parts.extend(STATE_EDIT.pack(*cell) for cell in edits)
+    return b''.join(parts)
+
+def load_state(engine, data):
+    """Restore a save_state() blob, reusing the current level when it matches"""
+    if len(data) < STATE_HEADER.size:
+        raise ValueError("truncated save state header")
+    (magic, fmt, state, world, level_num, endless, camera_x, frame_counter,
+     score, timer, title_y, title_flash, in_level, input_frame) = STATE_HEADER.unpack_from(data)
+    if magic != STATE_MAGIC or fmt != STATE_FORMAT:
+        raise ValueError(f"not a version {STATE_FORMAT} save state")
+    offset = STATE_HEADER.size
+    
+    level = None
+    if in_level:
+        if len(data) < offset + STATE_PLAYER.size + STATE_LEVEL.size:
+            raise ValueError("truncated save state")
+        player = STATE_PLAYER.unpack_from(data, offset)
+        offset += STATE_PLAYER.size
+        (origin, columns, spawn_cursor, spawn_count,
+         koopa_count, edit_count) = STATE_LEVEL.unpack_from(data, offset)
+        offset += STATE_LEVEL.size
+        if len(data) < offset + (spawn_count * LEVEL_SPAWN.size + koopa_count * EnemyPool.PACKED_SLOT
+                                 + edit_count * STATE_EDIT.size):
+            raise ValueError("truncated save state")
+        
+        # Same level and kind: keep it (and its nametable), else regenerate
+        level = engine.level
+        if (level is None or (level.world, level.level_num) != (world, level_num)
+                or isinstance(level, StreamingLevel) != bool(endless)):
+            engine.world, engine.level_num, engine.endless = world, level_num, bool(endless)
+            level = engine.make_level()
+        spawns = [LEVEL_SPAWN.unpack_from(data, offset + i * LEVEL_SPAWN.size)
+                  for i in range(spawn_count)]
+        offset += spawn_count * LEVEL_SPAWN.size
+        level.restore_window(origin, columns, spawns)
+        level.spawn_cursor = spawn_cursor
         
-        # NES-style 8x8 bitmap font patterns
-        font_data = {
-            'A': [0x18,0x3C,0x66,0x7E,0x66,0x66,0x66,0x00],
-            'B': [0x7C,0x66,0x66,0x7C,0x66,0x66,0x7C,0x00],
-            'C': [0x3C,0x66,0x60,0x60,0x60,0x66,0x3C,0x00],
-            'D': [0x78,0x6C,0x66,0x66,0x66,0x6C,0x78,0x00],
-            'E': [0x7E,0x60,0x60,0x78,0x60,0x60,0x7E,0x00],
-            'F': [0x7E,0x60,0x60,0x78,0x60,0x60,0x60,0x00],
-            'G': [0x3C,0x66,0x60,0x6E,0x66,0x66,0x3C,0x00],
-            'H': [0x66,0x66,0x66,0x7E,0x66,0x66,0x66,0x00],
-            'I': [0x3C,0x18,0x18,0x18,0x18,0x18,0x3C,0x00],
-            'J': [0x1E,0x0C,0x0C,0x0C,0x0C,0x6C,0x38,0x00],
-            'K': [0x66,0x6C,0x78,0x70,0x78,0x6C,0x66,0x00],
-            'L': [0x60,0x60,0x60,0x60,0x60,0x60,0x7E,0x00],
-            'M': [0x63,0x77,0x7F,0x6B,0x63,0x63,0x63,0x00],
-            'N': [0x66,0x76,0x7E,0x7E,0x6E,0x66,0x66,0x00],
-            'O': [0x3C,0x66,0x66,0x66,0x66,0x66,0x3C,0x00],
-            'P': [0x7C,0x66,0x66,0x7C,0x60,0x60,0x60,0x00],
-            'Q': [0x3C,0x66,0x66,0x66,0x66,0x3C,0x0E,0x00],
-            'R': [0x7C,0x66,0x66,0x7C,0x78,0x6C,0x66,0x00],
-            'S': [0x3C,0x66,0x60,0x3C,0x06,0x66,0x3C,0x00],
-            'T': [0x7E,0x18,0x18,0x18,0x18,0x18,0x18,0x00],
-            'U': [0x66,0x66,0x66,0x66,0x66,0x66,0x3C,0x00],
-            'V': [0x66,0x66,0x66,0x66,0x66,0x3C,0x18,0x00],
-            'W': [0x63,0x63,0x63,0x6B,0x7F,0x77,0x63,0x00],
-            'X': [0x66,0x66,0x3C,0x18,0x3C,0x66,0x66,0x00],
-            'Y': [0x66,0x66,0x66,0x3C,0x18,0x18,0x18,0x00],
-            'Z': [0x7E,0x06,0x0C,0x18,0x30,0x60,0x7E,0x00],
-            '0': [0x3C,0x66,0x6E,0x76,0x66,0x66,0x3C,0x00],
-            '1': [0x18,0x18,0x38,0x18,0x18,0x18,0x7E,0x00],
-            '2': [0x3C,0x66,0x06,0x0C,0x30,0x60,0x7E,0x00],
-            '3': [0x3C,0x66,0x06,0x1C,0x06,0x66,0x3C,0x00],
-            '4': [0x06,0x0E,0x1E,0x66,0x7F,0x06,0x06,0x00],
-            '5': [0x7E,0x60,0x7C,0x06,0x06,0x66,0x3C,0x00],
-            '6': [0x3C,0x66,0x60,0x7C,0x66,0x66,0x3C,0x00],
-            '7': [0x7E,0x66,0x0C,0x18,0x18,0x18,0x18,0x00],
-            '8': [0x3C,0x66,0x66,0x3C,0x66,0x66,0x3C,0x00],
-            '9': [0x3C,0x66,0x66,0x3E,0x06,0x66,0x3C,0x00],
-            ' ': [0x00,0x00,0x00,0x00,0x00,0x00,0x00,0x00],
-            ':': [0x00,0x18,0x18,0x00,0x00,0x18,0x18,0x00],
-            '-': [0x00,0x00,0x00,0x7E,0x00,0x00,0x00,0x00],
-            '!': [0x18,0x18,0x18,0x18,0x00,0x00,0x18,0x00],
-            '(': [0x0E,0x18,0x30,0x30,0x30,0x18,0x0E,0x00],
-            ')': [0x70,0x18,0x0C,0x0C,0x0C,0x18,0x70,0x00],
-            '=': [0x00,0x00,0x7E,0x00,0x7E,0x00,0x00,0x00],
-            '.': [0x00,0x00,0x00,0x00,0x00,0x18,0x18,0x00],
+        # A fresh pool; views of the old one keep their own arrays
+        level.enemies = EnemyPool.unpack(data, offset, koopa_count)
+        offset += koopa_count * EnemyPool.PACKED_SLOT
+        level.restore_edits([STATE_EDIT.unpack_from(data, offset + i * STATE_EDIT.size)
+                             for i in range(edit_count)])
+    
+    engine.state = ENGINE_STATES[state]
+    engine.world, engine.level_num, engine.endless = world, level_num, bool(endless)
+    engine.level = level
+    engine.camera_x = camera_x
+    engine.frame_counter = frame_counter
+    engine.score = score
+    engine.time = timer
+    engine.title_y, engine.title_flash = title_y, title_flash
+    if hasattr(engine.input, 'frame'):
+        engine.input.frame = input_frame
+    if level is None:
+        engine.player = None
+        return
+    if engine.player is None:
+        engine.player = KoopaPlayer()
+    p = engine.player
+    (p.x, p.y, p.vx, p.vy, p.on_ground, p.facing_right, p.run_held, p.jump_held,
+     p.jump_buffer, power, p.invincible, p.lives) = player
+    p.state = PLAYER_STATES[power]
+
+class RewindBuffer:
+    """A save state per frame, bounded, as keyframes plus small deltas
+    
+    Every KEYFRAME-th state is stored whole; the frames in between store
+    their XOR against that keyframe, which is almost all zero bytes and
+    compresses to a few dozen. Whole segments fall off the old end once
+    more than `seconds` of play is held.
+    """
+    
+    KEYFRAME = 60  # Frames per segment (one keyframe each)
+    SECONDS = 300  # Five minutes of rewind by default
+    DELTA_LENGTH = struct.Struct('<I')  # State length ahead of each delta
+    
+    def __init__(self, seconds=SECONDS):
+        self.capacity = max(1, int(seconds * FPS))
+        self.segments = deque()  # [compressed keyframe, [compressed deltas]]
+        self.keyframe = None  # Newest segment's keyframe, uncompressed
+        self.frames = 0
+        self.nbytes = 0  # Compressed bytes held
+    
+    def __len__(self):
+        return self.frames
+    
+    @staticmethod
+    def _xor(a, b):
+        size = max(len(a), len(b))
+        return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(size, 'little')
+    
+    def record(self, engine):
+        """Append the engine's current state"""
+        state = save_state(engine)
+        if not self.segments or len(self.segments[-1][1]) + 1 >= self.KEYFRAME:
+            self.keyframe = state
+            data = zlib.compress(state, 1)
+            self.segments.append([data, []])
+        else:
+            data = self.DELTA_LENGTH.pack(len(state)) + zlib.compress(
+                self._xor(state, self.keyframe), 1)
+            self.segments[-1][1].append(data)
+        self.frames += 1
+        self.nbytes += len(data)
+        while self.frames > self.capacity and len(self.segments) > 1:
+            keyframe, deltas = self.segments.popleft()
+            self.frames -= 1 + len(deltas)
+            self.nbytes -= len(keyframe) + sum(len(delta) for delta in deltas)
+    
+    def latest(self):
+        """Newest recorded state (None when empty)"""
+        if not self.segments:
+            return None
+        deltas = self.segments[-1][1]
+        if not deltas:
+            return self.keyframe
+        size, = self.DELTA_LENGTH.unpack_from(deltas[-1])
+        delta = zlib.decompress(deltas[-1][self.DELTA_LENGTH.size:])
+        return self._xor(delta, self.keyframe)[:size]
+    
+    def drop(self):
+        """Forget the newest recorded state"""
+        keyframe, deltas = self.segments[-1]
+        if deltas:
+            self.nbytes -= len(deltas.pop())
+        else:
+            self.nbytes -= len(keyframe)
+            self.segments.pop()
+            self.keyframe = zlib.decompress(self.segments[-1][0]) if self.segments else None
+        self.frames -= 1
+    
+    def rewind(self, engine):
+        """Step the engine back one frame; False once nothing older is left"""
+        if self.frames < 2:
+            return False
+        self.drop()
+        load_state(engine, self.latest())
+        return True
+    
+    def clear(self):
+        self.segments.clear()
+        self.keyframe = None
+        self.frames = 0
+        self.nbytes = 0
+
+# ---------------------------------------------
+# Frame Timing
+# ---------------------------------------------
+class FrameTimer:
+    """Fixed 60Hz simulation clock with an accumulator
+    
+    advance() turns elapsed wall time into whole simulation steps, so game
+    speed no longer depends on how long a frame takes to draw. Falling
+    behind skips renders (up to max_skip in a row) to catch up; time past
+    that is dropped, so a long stall slows the game instead of spiralling.
+    """
+    
+    STEP = 1 / FPS
+    MAX_SKIP = 4  # Renders skipped in a row before dropping time
+    SPIN = 0.002  # Busy-wait the last 2ms instead of trusting sleep()
+    HISTORY = 600  # Render intervals kept for pacing stats
+    
+    def __init__(self, max_skip=MAX_SKIP, busy_wait=False, clock=time.perf_counter):
+        self.max_skip = max_skip
+        self.busy_wait = busy_wait
+        self.clock = clock
+        self.accumulator = 0.0
+        self.last = None
+        self.last_render = None
+        self.intervals = deque(maxlen=self.HISTORY)
+        self.steps = 0
+        self.renders = 0
+        self.skipped = 0  # Renders skipped to catch up
+        self.dropped = 0  # Steps of wall time discarded past max_skip
+    
+    def advance(self):
+        """Simulation steps due since the last call (at most max_skip + 1)"""
+        now = self.clock()
+        if self.last is None:
+            self.last = now - self.STEP  # First call runs one step
+        self.accumulator += now - self.last
+        self.last = now
+        steps = int(self.accumulator / self.STEP)
+        limit = self.max_skip + 1
+        if steps > limit:
+            self.dropped += steps - limit
+            self.accumulator -= (steps - limit) * self.STEP
+            steps = limit
+        self.accumulator -= steps * self.STEP
+        if steps > 1:
+            self.skipped += steps - 1
+        self.steps += steps
+        return steps
+    
+    def rendered(self):
+        """Mark a frame as drawn, for the pacing stats"""
+        now = self.clock()
+        if self.last_render is not None:
+            self.intervals.append(now - self.last_render)
+        self.last_render = now
+        self.renders += 1
+    
+    def wait(self):
+        """Sleep, then optionally spin, until the next step is due"""
+        deadline = self.last + self.STEP - self.accumulator
+        remaining = deadline - self.clock() - (self.SPIN if self.busy_wait else 0)
+        if remaining > 0:
+            time.sleep(remaining)
+        if self.busy_wait:
+            while self.clock() < deadline:
+                pass
+    
+    def stats(self):
+        """Pacing summary: render interval mean/jitter/worst in ms, counters"""
+        intervals = sorted(ms * 1000 for ms in self.intervals)
+        count = len(intervals)
+        mean = sum(intervals) / count if count else 0.0
+        jitter = (sum((ms - mean) ** 2 for ms in intervals) / count) ** 0.5 if count else 0.0
+        return {
+            'steps': self.steps,
+            'renders': self.renders,
+            'skipped': self.skipped,
+            'dropped': self.dropped,
+            'mean_ms': mean,
+            'jitter_ms': jitter,
+            'p99_ms': intervals[min(count - 1, int(count * 0.99))] if count else 0.0,
+            'worst_ms': intervals[-1] if count else 0.0,
         }
+
+# ---------------------------------------------
+# Vector Environment (batched headless engines)
+# ---------------------------------------------
+ENV_INFO = ("score", "lives", "time", "world", "level", "state", "x", "y", "camera", "frame")
+ENV_INFO_STRUCT = struct.Struct('<%di' % len(ENV_INFO))
+ENV_OBSERVATIONS = {
+    "pixels": (NES_HEIGHT, NES_WIDTH, 4),  # RGBX bytes
+    "tiles": (30, NES_WIDTH // TILE_SIZE),  # Tile ids on screen
+}
+
+def env_layout(count, observation):
+    """Shared block offsets: (info, observations, observation size, total)
+    
+    Actions (one controller byte per engine) come first, then an
+    ENV_INFO_STRUCT per engine, then the observations.
+    """
+    info = (count + 7) & ~7
+    obs = info + count * ENV_INFO_STRUCT.size
+    size = 1
+    for dim in ENV_OBSERVATIONS[observation]:
+        size *= dim
+    return info, obs, size, obs + count * size
+
+def write_tiles(level, cam_x, out):
+    """On-screen tile ids of a level into a rows x columns buffer"""
+    rows, columns = ENV_OBSERVATIONS["tiles"]
+    out[:] = bytes(rows * columns)
+    if level is None:
+        return
+    first = cam_x // TILE_SIZE - level.origin
+    start, end = max(first, 0), min(first + columns, level.columns)
+    for ty in range(min(rows, level.height)):
+        row = ty * level.columns
+        out[ty * columns + start - first:ty * columns + end - first] = level.tilemap[row + start:row + end]
+
+def env_worker(conn, shm, count, observation, frameskip, endless, first, last):
+    """VectorEnv process: runs engines [first, last) on one-byte commands"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent owns Ctrl-C
+    init(headless=True)  # A no-op in forked workers, the display is inherited
+    LEVEL_CACHE.headless()
+    APU.enabled = False  # Workers stay silent, the mixer is never opened
+    info_offset, obs_offset, obs_size, _ = env_layout(count, observation)
+    buf = shm.buf
+    actions = buf[:count]
+    observations = [buf[obs_offset + i * obs_size:obs_offset + (i + 1) * obs_size]
+                    for i in range(first, last)]
+    if observation == "pixels":
+        # Engines render straight into their shared observation
+        frames = [pygame.image.frombuffer(obs, (NES_WIDTH, NES_HEIGHT), 'RGBX')
+                  for obs in observations]
+    
+    def new_engine(i):
+        engine = KoopaEngine(SharedInput(actions, i), endless)
+        engine.state = "GAME"
+        engine.start_game()
+        return engine
+    
+    def observe(slot, engine):
+        global DISPLAY
+        i = first + slot
+        player = engine.player
+        ENV_INFO_STRUCT.pack_into(
+            buf, info_offset + i * ENV_INFO_STRUCT.size, engine.score,
+            player.lives if player else 0, engine.time, engine.world,
+            engine.level_num, ENGINE_STATES.index(engine.state),
+            int(player.x) if player else 0, int(player.y) if player else 0,
+            int(engine.camera_x), engine.frame_counter)
+        if observation == "pixels":
+            DISPLAY = frames[slot]
+            engine.render()
+        else:
+            write_tiles(engine.level, int(engine.camera_x), observations[slot])
+    
+    engines = []
+    try:
+        while True:
+            command = conn.recv_bytes()
+            if command == b'Q':
+                break
+            if command == b'R':
+                engines = [new_engine(i) for i in range(first, last)]
+            else:
+                for slot, engine in enumerate(engines):
+                    if engine.state in ("GAMEOVER", "WIN"):
+                        engine = engines[slot] = new_engine(first + slot)
+                    for _ in range(frameskip):
+                        engine.update()
+            for slot, engine in enumerate(engines):
+                observe(slot, engine)
+            conn.send_bytes(b'.')
+    except Exception:
+        conn.send_bytes(b'!' + traceback.format_exc().encode())
+    finally:
+        conn.close()
+
+class VectorEnv:
+    """N headless engines across worker processes, stepped in lockstep
+    
+    step() takes one controller byte per engine. Actions, per-engine info
+    (ENV_INFO) and observations (ENV_OBSERVATIONS) share one block of
+    shared memory - pixel observations are the surfaces the engines render
+    into - and the pipes carry one-byte commands, so no frame is pickled
+    or copied. Engines start in GAME and restart on the step after a
+    GAMEOVER or WIN. With numpy, observations and info are arrays over the
+    shared block; otherwise lists of memoryviews.
+    """
+    
+    def __init__(self, count, workers=None, observation="pixels", frameskip=1, endless=False):
+        if observation not in ENV_OBSERVATIONS:
+            raise ValueError(f"observation must be one of {', '.join(ENV_OBSERVATIONS)}")
+        # Imported here: multiprocessing alone is a good part of our import time
+        import multiprocessing
+        from multiprocessing import shared_memory
+        self.count = count
+        info_offset, obs_offset, obs_size, total = env_layout(count, observation)
+        self.shm = shared_memory.SharedMemory(create=True, size=total)
+        buf = self.shm.buf
+        self.actions = buf[:count]
+        if numpy is not None:
+            self.info = numpy.ndarray((count, len(ENV_INFO)), '<i4', buf, info_offset)
+            self.observations = numpy.ndarray((count,) + ENV_OBSERVATIONS[observation],
+                                              numpy.uint8, buf, obs_offset)
+        else:
+            self.info = [buf[info_offset + i * ENV_INFO_STRUCT.size:
+                             info_offset + (i + 1) * ENV_INFO_STRUCT.size].cast('i')
+                         for i in range(count)]
+            self.observations = [buf[obs_offset + i * obs_size:obs_offset + (i + 1) * obs_size]
+                                 for i in range(count)]
         
-        char_width = 8
-        for i, char in enumerate(text.upper()):
-            char_x = x + i * char_width
-            if char in font_data:
-                pattern = font_data[char]
-                for row in range(8):
-                    for col in range(8):
-                        if pattern[row] & (1 << (7 - col)):
-                            DISPLAY.set_at((char_x + col, y + row), color)
+        # Fork where we can: workers share the mapping without re-attaching
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        workers = max(1, min(count, workers or os.cpu_count() or 1))
+        self.pipes = []
+        self.processes = []
+        for w in range(workers):
+            first, last = count * w // workers, count * (w + 1) // workers
+            parent, child = context.Pipe()
+            process = context.Process(target=env_worker, daemon=True, args=(
+                child, self.shm, count, observation, frameskip, endless, first, last))
+            process.start()
+            child.close()
+            self.pipes.append(parent)
+            self.processes.append(process)
+    
+    def _command(self, command):
+        for conn in self.pipes:
+            conn.send_bytes(command)
+        errors = [reply[1:].decode() for reply in (conn.recv_bytes() for conn in self.pipes)
+                  if reply != b'.']
+        if errors:
+            raise RuntimeError("VectorEnv worker failed:\n" + errors[0])
+    
+    def reset(self):
+        """Start every engine in a fresh game; returns the observations"""
+        self._command(b'R')
+        return self.observations
+    
+    def step(self, actions):
+        """Run one step (frameskip frames) with a controller byte per engine
+        
+        Returns (observations, info); both are views that the next step
+        overwrites.
+        """
+        self.actions[:] = bytes(actions) if numpy is None else numpy.asarray(actions, numpy.uint8)
+        self._command(b'S')
+        return self.observations, self.info
+    
+    def close(self):
+        if self.shm is None:
+            return
+        for conn in self.pipes:
+            try:
+                conn.send_bytes(b'Q')
+            except OSError:
+                pass  # Worker already gone
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        views = [self.actions]
+        if numpy is None:
+            views += self.info + self.observations
+        for view in views:
+            view.release()
+        self.actions = self.info = self.observations = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # Caller still holds a view; unmapped when it goes
+        self.shm.unlink()
+        self.shm = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def __del__(self):
+        if getattr(self, 'shm', None) is not None:
+            self.close()
 
 # ---------------------------------------------
 # Main Game Loop
 # ---------------------------------------------
-def main():
-    engine = KoopaEngine()
+def init(headless=False, scale=None, upscaler=None):
+    """Open the window and DISPLAY - call once before running an engine
+    
+    Headless uses SDL's dummy video and audio drivers and keeps generated
+    levels out of the home directory (LevelCache.headless). Only video is
+    started here: audio waits for the first sound (BootlegAPU.open).
+    Calling it again once open does nothing; use PRESENTER.configure()
+    to change the scale or upscaler.
+    """
+    global DISPLAY
+    if DISPLAY is not None and pygame.display.get_init():
+        return
+    if headless:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        LEVEL_CACHE.headless()
+    pygame.display.init()
+    pygame.time.Clock()  # Starts SDL's timer - get_ticks() reads 0 without it
+    pygame.display.set_caption(CAPTION)
+    PRESENTER.configure(scale, upscaler)
+    DISPLAY = pygame.Surface((NES_WIDTH, NES_HEIGHT)).convert()
+    STARTUP.mark("video")
+
+def run_headless(frames, input_source=None, render=False, endless=False):
+    """Step the engine uncapped and report simulated frames per second"""
+    init(headless=True)
+    APU.enabled = False  # Uncapped runs stay silent
+    engine = KoopaEngine(input_source or ScriptedInput.demo(), endless)
+    STARTUP.mark("engine")
+    start = time.perf_counter()
+    for _ in range(frames):
+        engine.update()
+        if render:
+            engine.draw()
+    elapsed = time.perf_counter() - start
+    fps = frames / elapsed if elapsed > 0 else float('inf')
+    return {
+        'frames': frames,
+        'seconds': elapsed,
+        'fps': fps,
+        'realtime': fps / FPS,
+        'state': engine.state,
+        'score': engine.score,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Koopa Engine")
+    parser.add_argument('--headless', action='store_true',
+                        help="dummy video/audio, uncapped, no keyboard")
+    parser.add_argument('--frames', type=int, default=6000,
+                        help="frames to simulate in headless mode")
+    parser.add_argument('--render', action='store_true',
+                        help="also draw each frame in headless mode")
+    parser.add_argument('--input', metavar='FILE',
+                        help="replay a recorded controller file")
+    parser.add_argument('--record', metavar='FILE',
+                        help="record controller input to a file")
+    parser.add_argument('--perf', action='store_true',
+                        help="start with the performance overlay (F3)")
+    parser.add_argument('--endless', action='store_true',
+                        help="endless levels streamed in chunks")
+    parser.add_argument('--sprite-limit', action='store_true',
+                        help="emulate the NES 8 sprites per scanline limit")
+    parser.add_argument('--dirty-rects', action='store_true',
+                        help="present only changed regions (skip static frames)")
+    parser.add_argument('--scale', type=int,
+                        help=f"integer window scale (default {SCALE})")
+    parser.add_argument('--upscaler', choices=sorted(UPSCALERS), default=CachedUpscaler.NAME,
+                        help="output scaling backend")
+    parser.add_argument('--max-skip', type=int, default=FrameTimer.MAX_SKIP,
+                        help="renders skipped in a row to keep game speed")
+    parser.add_argument('--busy-wait', action='store_true',
+                        help="spin the last ms of each frame for exact pacing")
+    parser.add_argument('--pacing', action='store_true',
+                        help="print frame pacing stats on exit")
+    parser.add_argument('--rewind', action='store_true',
+                        help=f"record {RewindBuffer.SECONDS}s of rewind (hold BACKSPACE)")
+    parser.add_argument('--state', metavar='FILE',
+                        help="save state file: loaded at start, F5 saves, F9 loads")
+    parser.add_argument('--capture', metavar='PATH',
+                        help="record drawn frames to a raw stream (or PNG directory)")
+    parser.add_argument('--capture-format', choices=FrameCapture.FORMATS, default="raw",
+                        help="raw video stream or PNG sequence")
+    parser.add_argument('--startup-profile', action='store_true',
+                        help="print time to first frame by startup phase on exit")
+    args = parser.parse_args(argv)
+    if args.scale is not None and args.scale < 1:
+        parser.error(f"--scale must be a positive integer, got {args.scale}")
+    STARTUP.mark("arguments")
+    
+    init(args.headless, args.scale, args.upscaler)
+    if args.perf:
+        PERF.enable()
+    OAM.scanline_limit = args.sprite_limit
+    PRESENTER.set_dirty_rects(args.dirty_rects)
+    if args.capture:
+        CAPTURE.start(args.capture, args.capture_format)
+    
+    def report_startup():
+        if args.startup_profile:
+            print("\n".join(STARTUP.lines()))
+    
+    def stop_capture():
+        stats = CAPTURE.stop()
+        if stats is None:
+            return
+        print(f"capture {stats['path']}: {stats['written']} frames written, "
+              f"{stats['dropped']} dropped" + (f", {stats['failed']} failed ({stats['error']})"
+                                                if stats['error'] else ""))
+        if stats['format'] == "raw":
+            print(f"  ffmpeg -f rawvideo -pix_fmt {stats['pixel_format']} "
+                  f"-s {NES_WIDTH}x{NES_HEIGHT} -r {FPS} -i {stats['path']} out.mp4")
+    
+    input_source = ScriptedInput.load(args.input) if args.input else None
+    if args.headless:
+        stats = run_headless(args.frames, input_source, args.render, args.endless)
+        print(f"{stats['frames']} frames in {stats['seconds']:.2f}s: "
+              f"{stats['fps']:.0f} fps ({stats['realtime']:.1f}x real time), "
+              f"state={stats['state']} score={stats['score']}")
+        report_startup()
+        stop_capture()
+        pygame.quit()
+        return
+    
+    if args.record:
+        input_source = InputRecorder(input_source or KeyboardInput())
+    engine = KoopaEngine(input_source, args.endless)
+    timer = FrameTimer(max(0, args.max_skip), args.busy_wait)
+    rewind = RewindBuffer() if args.rewind else None
+    if args.state and os.path.exists(args.state):
+        with open(args.state, 'rb') as f:
+            load_state(engine, f.read())
+    STARTUP.mark("engine")
     running = True
     
     while running:
@@ -938,16 +3488,50 @@ def main():
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     running = False
+                elif event.key == pygame.K_F3:
+                    PERF.toggle()
+                elif event.key == pygame.K_F5 and args.state:
+                    with open(args.state, 'wb') as f:
+                        f.write(save_state(engine))
+                elif event.key == pygame.K_F9 and args.state and os.path.exists(args.state):
+                    with open(args.state, 'rb') as f:
+                        load_state(engine, f.read())
+            elif event.type == pygame.VIDEOEXPOSE:
+                PRESENTER.invalidate()
         
-        # Update
-        engine.update()
+        # Update at a fixed 60Hz, however long drawing takes
+        # (or step back through the rewind buffer while BACKSPACE is held)
+        steps = timer.advance()
+        rewinding = rewind is not None and pygame.key.get_pressed()[pygame.K_BACKSPACE]
+        for _ in range(steps):
+            if rewinding:
+                rewind.rewind(engine)
+            else:
+                engine.update()
+                if rewind is not None:
+                    rewind.record(engine)
         
-        # Draw
-        engine.draw()
+        # Draw (nothing new if we woke before the next step)
+        if steps:
+            engine.draw()
+            timer.rendered()
         
         # Frame rate
-        CLOCK.tick(FPS)
+        timer.wait()
     
+    if args.record:
+        input_source.save(args.record)
+    if args.pacing:
+        stats = timer.stats()
+        print(f"{stats['steps']} steps, {stats['renders']} renders "
+              f"({stats['skipped']} skipped, {stats['dropped']} steps dropped): "
+              f"frame {stats['mean_ms']:.2f}ms avg, {stats['jitter_ms']:.2f}ms jitter, "
+              f"{stats['p99_ms']:.2f}ms p99, {stats['worst_ms']:.2f}ms worst")
+    report_startup()
+    stop_capture()
     pygame.quit()
+
+STARTUP.mark("import mario4k")
+
 if __name__ == "__main__":
     main()